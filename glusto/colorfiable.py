@@ -83,6 +83,7 @@ class Colorfiable(object):
     """Constant for command return code (BOLD | BLUE)"""
 
     _ANSI = {}
+    _ansi_codes = {}
 
     # ANSI Attribute Values
     _ANSI[NORMAL] =         0
@@ -150,14 +151,40 @@ class Colorfiable(object):
         if not log_color:
             return message
 
-        ansi_list = []
-        for i in range(0, len(cls._ANSI) - 1):
-            bitplace = 1 << i
-            if color & bitplace:
-                ansi_list.append(str(cls._ANSI[bitplace]))
+        color_start, color_end = cls.colorfy_codes(color)
 
-        color_mod = ";".join(ansi_list)
-        color_string = "\033[%sm{0}\033[0m" % color_mod
-        color_message = "".join(color_string.format(message))
+        return "%s%s%s" % (color_start, message, color_end)
 
-        return color_message
+    @classmethod
+    def colorfy_codes(cls, color):
+        """Get the ANSI codes that start and end a color.
+
+        Handy for wrapping a message without building a colored copy of it
+        (e.g., as lazy logging arguments).
+
+        Args:
+            color (int): Bitwise value(s) for color settings.
+
+        Returns:
+            A tuple of the start and end code strings.
+            Empty strings if log_color is False in the config.
+
+        Example:
+            >>> start, end = g.colorfy_codes(g.RED)
+            >>> g.log.info("%s%s%s", start, 'Red text', end)
+        """
+        log_color = cls.config.get('log_color', True)
+        if not log_color:
+            return ('', '')
+
+        if color not in cls._ansi_codes:
+            ansi_list = []
+            for i in range(0, len(cls._ANSI) - 1):
+                bitplace = 1 << i
+                if color & bitplace:
+                    ansi_list.append(str(cls._ANSI[bitplace]))
+
+            color_mod = ";".join(ansi_list)
+            cls._ansi_codes[color] = ("\033[%sm" % color_mod, "\033[0m")
+
+        return cls._ansi_codes[color]
@@ -21,27 +21,694 @@ NOTE:
 """
 import subprocess
 import os
+import errno
+import hashlib
+import math
+import pipes
+import random
+import re
+import select
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque, OrderedDict
+from multiprocessing.pool import ThreadPool
 
 from plumbum import SshMachine
 
 
+class _OutputPoller(object):
+    """Reads stdout and stderr from many running commands in one poll loop.
+
+    Commands are added by key (e.g., the hostname) and poll() returns
+    the output chunks read since the last call, along with the return code
+    of each command as it completes.
+    """
+
+    def __init__(self, chunk_size=65536):
+        self.chunk_size = chunk_size
+        self._procs = {}
+        self._streams = {}
+        self._poller = None
+        if hasattr(select, 'poll'):
+            self._poller = select.poll()
+
+    def __len__(self):
+        return len(self._procs)
+
+    def __contains__(self, key):
+        return key in self._procs
+
+    def add(self, key, proc):
+        """Start reading the output of a running command.
+
+        Args:
+            key (str): The name returned with events for this command.
+            proc (obj): A popen object with stdout and stderr pipes.
+        """
+        self._procs[key] = [proc, 0]
+        for name in ('stdout', 'stderr'):
+            stream = getattr(proc, name, None)
+            if stream is None:
+                continue
+            fd = stream.fileno()
+            self._streams[fd] = (key, name, stream)
+            self._procs[key][1] += 1
+            if self._poller:
+                self._poller.register(fd, select.POLLIN | select.POLLPRI |
+                                      select.POLLHUP | select.POLLERR)
+
+    def remove(self, key):
+        """Stop reading the output of a command.
+
+        Args:
+            key (str): The name the command was added with.
+
+        Returns:
+            The popen object for the command.
+        """
+        for fd, (stream_key, _, stream) in self._streams.items():
+            if stream_key == key:
+                self._close_stream(fd, stream)
+
+        return self._procs.pop(key)[0]
+
+    def _close_stream(self, fd, stream):
+        if self._poller:
+            self._poller.unregister(fd)
+        del self._streams[fd]
+        stream.close()
+
+    def _wait_ready(self, timeout):
+        try:
+            if self._poller:
+                if timeout is not None:
+                    timeout = timeout * 1000
+                return [fd for fd, _ in self._poller.poll(timeout)]
+
+            ready, _, _ = select.select(self._streams.keys(), [], [],
+                                        timeout)
+            return ready
+        except select.error as err:
+            if err.args[0] == errno.EINTR:
+                return []
+            raise
+
+    def poll(self, timeout=None):
+        """Wait for output from the running commands.
+
+        Args:
+            timeout (optional[float]): Seconds to wait for output.
+                Waits until output is available by default.
+
+        Returns:
+            A list of events. Each event is a tuple of (key, 'stdout', data),
+            (key, 'stderr', data), or (key, 'retcode', returncode).
+        """
+        events = []
+        for fd in self._wait_ready(timeout):
+            key, name, stream = self._streams[fd]
+            data = os.read(fd, self.chunk_size)
+            if data:
+                events.append((key, name, data))
+                continue
+
+            # end of stream. the command is done when both streams close.
+            self._close_stream(fd, stream)
+            self._procs[key][1] -= 1
+            if self._procs[key][1] == 0:
+                proc = self._procs.pop(key)[0]
+                proc.wait()
+                events.append((key, 'retcode', proc.returncode))
+
+        return events
+
+
+class _OutputCapture(object):
+    """Collects the output of a command stream with a bounded footprint.
+
+    The capture mode is None (keep everything in memory), a number of bytes
+    (keep only the head and tail of the output in memory), or 'file'
+    (write the output to an unnamed temporary file).
+    """
+
+    def __init__(self, capture=None):
+        self.size = 0
+        self.limit = None
+        self._file = None
+        self._head = []
+        self._head_size = 0
+        self._tail = deque()
+        self._tail_size = 0
+        if capture == 'file':
+            self._file = tempfile.TemporaryFile(prefix='glusto_')
+        elif capture:
+            self.limit = int(capture)
+
+    def write(self, data):
+        """Add a chunk of output."""
+        self.size += len(data)
+        if self._file:
+            self._file.write(data)
+            return
+
+        if self.limit is None:
+            self._head.append(data)
+            return
+
+        # fill the head first. the rest goes to the tail.
+        room = self.limit - self.limit // 2 - self._head_size
+        if room > 0:
+            self._head.append(data[:room])
+            self._head_size += len(data[:room])
+            data = data[room:]
+        if not data:
+            return
+
+        self._tail.append(data)
+        self._tail_size += len(data)
+        while len(self._tail) > 1 and \
+                self._tail_size - len(self._tail[0]) >= self.limit // 2:
+            self._tail_size -= len(self._tail.popleft())
+
+    def getvalue(self):
+        """Return the captured output.
+
+        Returns:
+            A string, or a file object positioned at the start of the output
+            for 'file' mode. The file can be read or mmap'd.
+            Output beyond the limit is replaced by a truncation marker.
+        """
+        if self._file:
+            self._file.flush()
+            self._file.seek(0)
+            return self._file
+
+        head = ''.join(self._head)
+        tail = ''.join(self._tail)
+        if self.limit is None or self.size <= self.limit:
+            return head + tail
+
+        tail = tail[len(tail) - self.limit // 2:]
+        return "%s\n... [%i bytes truncated] ...\n%s" % \
+            (head, self.size - len(head) - len(tail), tail)
+
+
+class _SshConnectionPool(object):
+    """A thread-safe cache of ssh connections labeled by user@host.
+
+    Connections are checked for liveness before reuse and reconnected
+    transparently. Idle connections and the least recently used connections
+    beyond the size limit are closed. Read-only dictionary access to the
+    connections is provided for backward compatibility.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._name_locks = {}
+        self._connections = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0,
+                      'reconnects': 0, 'evictions': 0}
+        """Counters for connection reuse (hits), creation (misses),
+        replacement of dead connections (reconnects), and evictions."""
+
+    def __contains__(self, name):
+        return name in self._connections
+
+    def __getitem__(self, name):
+        with self._lock:
+            return self._connections[name][0]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self._connections)
+
+    def keys(self):
+        with self._lock:
+            return list(self._connections.keys())
+
+    def items(self):
+        with self._lock:
+            return [(name, entry[0]) for name, entry in
+                    self._connections.items()]
+
+    def values(self):
+        return [connection for _, connection in self.items()]
+
+    def get(self, name, default=None):
+        with self._lock:
+            entry = self._connections.get(name)
+
+        return entry[0] if entry else default
+
+    def has_key(self, name):
+        return name in self
+
+    def iterkeys(self):
+        return iter(self.keys())
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def copy(self):
+        """A dictionary of the connections labeled by user@host."""
+        return dict(self.items())
+
+    def get_connection(self, name, create, is_alive,
+                       max_size=None, max_idle=None):
+        """Retrieve a live connection from the pool or create a new one.
+
+        Args:
+            name (str): The name of the connection (user@host).
+            create (callable): Returns a new connection. None on failure.
+            is_alive (callable): Returns True if a connection is usable.
+            max_size (optional[int]): The maximum number of connections.
+            max_idle (optional[int]): Seconds a connection can sit unused
+                before it is closed.
+
+        Returns:
+            A connection object. None on failure.
+        """
+        with self._lock:
+            name_lock = self._name_locks.setdefault(name, threading.Lock())
+            stale = self._evict_idle(max_idle)
+
+        self._close_all(stale)
+
+        # only one thread creates a connection for a name at a time
+        with name_lock:
+            with self._lock:
+                entry = self._connections.get(name)
+
+            if entry:
+                if is_alive(entry[0]):
+                    with self._lock:
+                        self.stats['hits'] += 1
+                        entry[1] = time.time()
+                        self._connections[name] = \
+                            self._connections.pop(name)
+                    return entry[0]
+
+                with self._lock:
+                    self.stats['reconnects'] += 1
+                    self._connections.pop(name, None)
+                self._close_all([entry[0]])
+            else:
+                with self._lock:
+                    self.stats['misses'] += 1
+
+            connection = create()
+            if connection is None:
+                return None
+
+            with self._lock:
+                self._connections[name] = [connection, time.time()]
+                stale = self._evict_oldest(max_size)
+
+        self._close_all(stale)
+
+        return connection
+
+    def remove(self, name):
+        """Remove a connection from the pool without closing it.
+
+        Args:
+            name (str): The name of the connection (user@host).
+
+        Returns:
+            The connection object. None if not in the pool.
+        """
+        with self._lock:
+            entry = self._connections.pop(name, None)
+
+        if entry:
+            return entry[0]
+
+        return None
+
+    def _evict_idle(self, max_idle):
+        stale = []
+        if not max_idle:
+            return stale
+
+        expired = time.time() - max_idle
+        for name, entry in self._connections.items():
+            if entry[1] < expired:
+                stale.append(self._connections.pop(name)[0])
+                self.stats['evictions'] += 1
+
+        return stale
+
+    def _evict_oldest(self, max_size):
+        stale = []
+        while max_size and len(self._connections) > max_size:
+            _, entry = self._connections.popitem(last=False)
+            stale.append(entry[0])
+            self.stats['evictions'] += 1
+
+        return stale
+
+    @staticmethod
+    def _close_all(connections):
+        for connection in connections:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+
+class _ResultCache(object):
+    """A thread-safe LRU cache of command results with per-entry TTLs.
+
+    Results are labeled by (user, host, command).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+        """Counters for results served from the cache (hits), not found
+        (misses), found but too old (expired), and evictions."""
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, key):
+        """Retrieve a result that has not expired.
+
+        Args:
+            key (tuple): The (user, host, command) of the result.
+
+        Returns:
+            The cached result. None if not cached or expired.
+        """
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+
+            if entry[0] < time.time():
+                del self._results[key]
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+
+            self.stats['hits'] += 1
+            self._results[key] = self._results.pop(key)
+
+            return entry[1]
+
+    def set(self, key, result, ttl, max_size=None):
+        """Add a result to the cache.
+
+        Args:
+            key (tuple): The (user, host, command) of the result.
+            result (tuple): The result to cache.
+            ttl (int): Seconds the result can be served from the cache.
+            max_size (optional[int]): The maximum number of results kept.
+                The least recently used results are evicted first.
+        """
+        with self._lock:
+            self._results.pop(key, None)
+            self._results[key] = (time.time() + ttl, result)
+            while max_size and len(self._results) > max_size:
+                self._results.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def invalidate(self, host=None, command=None, user=None):
+        """Remove results from the cache.
+
+        Args:
+            host (optional[str]): Only remove results for this host.
+            command (optional[str]): Only remove results for this command.
+            user (optional[str]): Only remove results for this user.
+
+        Returns:
+            The number of results removed.
+        """
+        with self._lock:
+            keys = [key for key in self._results
+                    if (user is None or key[0] == user) and
+                    (host is None or key[1] == host) and
+                    (command is None or key[2] == command)]
+            for key in keys:
+                del self._results[key]
+
+        return len(keys)
+
+
+class RemoteSession(object):
+    """A long-lived shell on a remote system.
+
+    Commands are written to the shell's stdin and their output is framed
+    with a marker, so consecutive commands reuse one remote process and
+    keep the working directory and environment set by the commands before.
+    Created with Connectible.session().
+    """
+
+    def __init__(self, connectible, host, user):
+        self.host = host
+        self.user = user
+        self.restarts = 0
+        """The number of times the shell was restarted after it died"""
+        self._connectible = connectible
+        self._proc = None
+        self._poller = None
+        self._marker = "__glusto_session_%s__" % uuid.uuid4().hex
+        self._stdout_end = re.compile(r"\n%s (-?\d+)\n$" % self._marker)
+        self._stderr_end = "\n%s\n" % self._marker
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def alive(self):
+        """True if the remote shell is running."""
+        return self._proc is not None and self._proc.poll() is None
+
+    def run(self, command, timeout=None, log_level=None):
+        """Run a command in the session.
+
+        If the shell has died, a new one is started first
+        (the working directory and environment are reset).
+
+        Args:
+            command (str): The command to run.
+            timeout (optional[int]): Seconds before the command is killed.
+                The shell is killed with it and a new one is started by
+                the next run(). Defaults to command_timeout in the config.
+            log_level (optional[str]): only log stdout/stderr at this level.
+
+        Returns:
+            A tuple consisting of the command return code, stdout, and stderr.
+            If the shell exits while running the command (e.g., the command
+            calls exit), the return code is the exit status of the shell.
+        """
+        conn = self._connectible
+        identifier = "%s@%s" % (self.user, self.host)
+
+        color_start, color_end = conn.colorfy_codes(conn.COLOR_COMMAND)
+        conn.log.info("%s%s (session): %s%s", color_start, identifier,
+                      command, color_end)
+
+        # stdin is the session, so commands read from /dev/null
+        script = ("{ %s\n} </dev/null\n__glusto_rc=$?\n"
+                  "printf '\\n%%s %%d\\n' %s $__glusto_rc\n"
+                  "printf '\\n%%s\\n' %s >&2\n" %
+                  (command, self._marker, self._marker))
+
+        # a command sent to a shell that is already gone has not run,
+        # so it is safe to send it again to a new shell
+        for _ in range(2):
+            if not self.alive:
+                if self._proc is not None:
+                    self.restarts += 1
+                    conn.log.warning("Shell session on %s died. "
+                                     "Starting a new one." % identifier)
+                    self.close()
+                if not self._start():
+                    conn.log.error("ERROR: No ssh connection")
+                    return (42, None, "ERROR: No ssh connection")
+            try:
+                self._proc.stdin.write(script)
+                self._proc.stdin.flush()
+                break
+            except Exception:
+                # IOError with plumbum. socket or paramiko errors with native.
+                self.close()
+        else:
+            conn.log.error("ERROR: Unable to start shell session")
+            return (42, None, "ERROR: Unable to start shell session")
+
+        start = time.time()
+        retcode, stdout, stderr = self._read(conn._get_timeout(timeout))
+        conn.metrics_observe('command_seconds', 'session', self.host,
+                             time.time() - start)
+        conn._log_results(identifier, retcode, stdout, stderr,
+                          log_level=log_level)
+
+        return (retcode, stdout, stderr)
+
+    def close(self):
+        """Exit the remote shell.
+
+        The shell is given a few seconds to exit before it is killed.
+        """
+        if self._proc is None:
+            return
+
+        proc = self._proc
+        self._proc = None
+        if proc.poll() is None:
+            try:
+                # the shell exits at the end of its input
+                proc.stdin.close()
+            except Exception:
+                pass
+            deadline = time.time() + 5
+            while self.host in self._poller and time.time() < deadline:
+                self._poller.poll(deadline - time.time())
+
+        if self.host in self._poller:
+            self._poller.remove(self.host)
+            self._connectible._kill_proc(proc)
+        proc.wait()
+
+    def _start(self):
+        """Start the remote shell.
+
+        Returns:
+            True on success. False if there is no ssh connection.
+        """
+        conn = self._connectible
+        ssh = conn._get_ssh_connection(self.host, self.user)
+        if not ssh:
+            return False
+
+        # killable, so a hung command can be killed along with the shell
+        self._proc = conn._popen(ssh, self.host, self.user, "exec bash",
+                                 killable=True)
+        self._poller = _OutputPoller()
+        self._poller.add(self.host, self._proc)
+
+        return True
+
+    def _read(self, timeout):
+        """Read the output of the command sent to the shell.
+
+        Args:
+            timeout (int): Seconds before the command is killed.
+                None for no timeout.
+
+        Returns:
+            A tuple of the return code, stdout, and stderr.
+        """
+        conn = self._connectible
+        deadline = None
+        if timeout:
+            deadline = time.time() + timeout
+
+        output = {'stdout': [], 'stderr': []}
+        tails = {'stdout': '', 'stderr': ''}
+        done = set()
+        while len(done) < 2:
+            wait = None
+            if deadline:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    conn.log.warning("Command in shell session on %s@%s "
+                                     "timed out after %ss. Killing the shell."
+                                     % (self.user, self.host, timeout))
+                    conn._kill_proc(self._proc)
+                    self.close()
+                    return (conn.TIMEOUT_RETCODE, ''.join(output['stdout']),
+                            ''.join(output['stderr']))
+
+            for _, stream, data in self._poller.poll(wait):
+                if stream == 'retcode':
+                    # the shell is gone. the next run() starts a new one.
+                    conn.log.warning("Shell session on %s@%s exited with %s"
+                                     % (self.user, self.host, data))
+                    return (data, ''.join(output['stdout']),
+                            ''.join(output['stderr']))
+
+                output[stream].append(data)
+                # the markers are the last output of the command,
+                # so only the tail of each stream is checked
+                tail = (tails[stream] + data)[-len(self._marker) - 32:]
+                tails[stream] = tail
+                if stream == 'stdout' and self._stdout_end.search(tail):
+                    done.add(stream)
+                elif stream == 'stderr' and tail.endswith(self._stderr_end):
+                    done.add(stream)
+
+        stdout = ''.join(output['stdout'])
+        stderr = ''.join(output['stderr'])
+        match = self._stdout_end.search(stdout)
+
+        return (int(match.group(1)), stdout[:match.start()],
+                stderr[:-len(self._stderr_end)])
+
+
 class Connectible(object):
     """The class provding remote connections and local commands."""
 
-    _ssh_connections = {}
-    """The dictionary of ssh connections used by the inheriting class"""
+    _ssh_connections = _SshConnectionPool()
+    """The pool of ssh connections used by the inheriting class"""
     # TODO: config override
     use_controlpersist = True
     user = "root"
+    max_workers = 32
+    """The default cap on concurrent workers used by the parallel methods.
+    Override with max_workers in the config."""
+    relay_scp_opts = ('-oBatchMode=yes -oStrictHostKeyChecking=no '
+                      '-oConnectTimeout=10')
+    """The scp options used between remote systems by upload_many(relay=True)
+    (the same non-interactive options as the local ssh connections)."""
+    ssh_backend = 'plumbum'
+    """The default ssh transport. 'plumbum' forks an ssh client per command.
+    'native' keeps an in-process paramiko connection. Override with
+    ssh_backend in the config."""
+    ssh_channels_per_host = 1
+    """The default number of ssh channels (connections) per user@host.
+    Override with ssh_channels_per_host in the config."""
+    _ssh_channel_load = {}
+    """The number of commands running on each ssh channel"""
+    _ssh_channel_lock = threading.Lock()
+    TIMEOUT_RETCODE = 124
+    """The return code for commands killed after exceeding their timeout.
+    The default timeout for all commands can be set with command_timeout
+    in the config."""
+    _run_cache = _ResultCache()
+    """The cache of command results used by run() with a cache_ttl"""
+    run_cache_size = 256
+    """The default maximum number of cached command results.
+    Override with run_cache_size in the config."""
     # log_color = True
 
     @classmethod
-    def _get_ssh_connection(cls, host, user=None):
+    def _get_ssh_connection(cls, host, user=None, channel=0, backend=None):
         """Setup an SshMachine connection.
 
         Args:
             host (str): Hostname of the system.
             user (optional[str]): User to use for connection.
+            channel (optional[int]): The channel number when multiple
+                connections to the same user@host are used.
+                Each channel has its own ControlMaster socket.
+            backend (optional[str]): The ssh transport to use.
+                'plumbum' (ssh client processes) or 'native' (paramiko).
+                Defaults to ssh_backend in the config (or 'plumbum').
 
         Returns:
             An ssh connection object on success.
@@ -50,11 +717,19 @@ class Connectible(object):
         if not user:
             user = cls.user
 
+        if not backend:
+            backend = cls.config.get('ssh_backend', cls.ssh_backend)
+        if backend not in ('plumbum', 'native'):
+            cls.log.error("Unknown ssh_backend: %s" % backend)
+            return None
+
         ssh_opts = ()
         ssh_opts += ('-oPasswordAuthentication=no',
                      '-oStrictHostKeyChecking=no',
                      '-oPort=22',
-                     '-oConnectTimeout=10')
+                     '-oConnectTimeout=10',
+                     '-oServerAliveInterval=30',
+                     '-oServerAliveCountMax=3')
 
         keyfile = None
         if 'ssh_keyfile' in cls.config:
@@ -63,28 +738,42 @@ class Connectible(object):
             ssh_opts += ('-o', 'IdentityFile=%s' % keyfile)
 
         if cls.use_controlpersist:
+            control_path = '~/.ssh/glusto-ssh-%r@%h:%p'
+            if channel:
+                control_path = '%s-%i' % (control_path, channel)
             ssh_opts += ('-oControlMaster=auto',
                          '-oControlPersist=4h',
-                         '-oControlPath=~/.ssh/glusto-ssh-%r@%h:%p')
+                         '-oControlPath=%s' % control_path)
 
         scp_opts = ssh_opts
 
         ssh_opts += ('-T',)
 
-        conn_name = "%s@%s" % (user, host)
-        # if no existing connection, create one
-        if conn_name not in cls._ssh_connections:
+        conn_name = cls._ssh_channel_name(host, user, channel)
+        if backend == 'native':
+            conn_name = "%s (native)" % conn_name
+
+        def create():
             cls.log.debug("Creating connection: %s" % conn_name)
             try:
-                ssh = SshMachine(host, user,
-                                 ssh_opts=ssh_opts, scp_opts=scp_opts)
+                with cls.metrics_timer('connect_seconds', 'ssh', host):
+                    if backend == 'native':
+                        # paramiko is optional. only import when requested.
+                        from glusto.nativessh import NativeSshMachine
+
+                        return NativeSshMachine(host, user, keyfile=keyfile)
+
+                    return SshMachine(host, user,
+                                      ssh_opts=ssh_opts, scp_opts=scp_opts)
             except:
                 cls.log.error("Exception trying to establish SshMachine")
                 return None
-            cls._ssh_connections[conn_name] = ssh
-        else:
-            cls.log.debug("Retrieved connection from cache: %s" % conn_name)
-            ssh = cls._ssh_connections[conn_name]
+
+        # reuse a live connection from the pool or create one
+        ssh = cls._ssh_connections.get_connection(
+            conn_name, create, cls._ssh_connection_alive,
+            max_size=cls.config.get('ssh_pool_max_size'),
+            max_idle=cls.config.get('ssh_pool_max_idle'))
 
         if ssh:
             return ssh
@@ -92,8 +781,96 @@ class Connectible(object):
         print("oops. did not get ssh for %s", conn_name)
         return None
 
+    @staticmethod
+    def _ssh_connection_alive(ssh):
+        """Check an SshMachine connection is still usable.
+
+        The check is local (the ssh session process is still running),
+        so it does not cost a round-trip to the remote system.
+
+        Args:
+            ssh (obj): An SshMachine connection.
+
+        Returns:
+            True if the connection is alive. False if not.
+        """
+        # native connections check their own transport
+        alive = getattr(ssh, 'alive', None)
+        if alive is None:
+            session = getattr(ssh, '_session', None)
+            alive = getattr(session, 'alive', None)
+        if alive is None:
+            return False
+
+        return bool(alive())
+
+    @staticmethod
+    def _ssh_channel_name(host, user, channel=0):
+        """Create a name for an ssh channel.
+
+        Args:
+            host (str): Hostname of the system.
+            user (str): User to use for connection.
+            channel (optional[int]): The channel number.
+
+        Returns:
+            user@host for the first channel and user@host#channel for others.
+        """
+        if channel:
+            return "%s@%s#%i" % (user, host, channel)
+
+        return "%s@%s" % (user, host)
+
+    @classmethod
+    def _ssh_checkout_channel(cls, host, user):
+        """Reserve the least busy ssh channel for a command.
+
+        Args:
+            host (str): Hostname of the system.
+            user (str): User to use for connection.
+
+        Returns:
+            The channel number (int).
+            Release with _ssh_checkin_channel() when the command is done.
+        """
+        num_channels = int(cls.config.get('ssh_channels_per_host',
+                                          cls.ssh_channels_per_host))
+        with cls._ssh_channel_lock:
+            loads = []
+            for channel in range(max(1, num_channels)):
+                name = cls._ssh_channel_name(host, user, channel)
+                loads.append((cls._ssh_channel_load.get(name, 0), channel))
+            _, channel = min(loads)
+
+            name = cls._ssh_channel_name(host, user, channel)
+            cls._ssh_channel_load[name] = \
+                cls._ssh_channel_load.get(name, 0) + 1
+
+        return channel
+
+    @classmethod
+    def _ssh_checkin_channel(cls, host, user, channel):
+        """Release an ssh channel reserved by _ssh_checkout_channel().
+
+        Args:
+            host (str): Hostname of the system.
+            user (str): User to use for connection.
+            channel (int): The channel number.
+
+        Returns:
+            Nothing
+        """
+        name = cls._ssh_channel_name(host, user, channel)
+        with cls._ssh_channel_lock:
+            load = cls._ssh_channel_load.get(name, 0) - 1
+            if load > 0:
+                cls._ssh_channel_load[name] = load
+            else:
+                cls._ssh_channel_load.pop(name, None)
+
     @classmethod
-    def run(cls, host, command, user=None, log_level=None):
+    def run(cls, host, command, user=None, log_level=None, timeout=None,
+            capture=None, cache_ttl=None):
         """Run a command on a remote host via ssh.
 
         Args:
@@ -101,9 +878,25 @@ class Connectible(object):
             command (str): The command to run on the system.
             user (optional[str]): The user to use for connection.
             log_level (optional[str]): only log stdout/stderr at this level.
+            timeout (optional[int]): Seconds to wait before killing the
+                command (and any processes it started on the remote system).
+                Defaults to command_timeout in the config (or no timeout).
+                Zero disables the timeout.
+            capture (optional[int|str]): Limit the output kept in memory.
+                A number of bytes keeps the head and tail of each stream
+                and truncates the middle. 'file' returns stdout and stderr
+                as temporary file objects (e.g., for mmap) instead of
+                strings. Defaults to capture_limit in the config
+                (or all output as strings).
+            cache_ttl (optional[int]): Seconds to reuse the result of this
+                command on this host instead of running it again.
+                Only for read-only commands. Only successful results
+                (return code 0) are cached. See run_cache_invalidate().
 
         Returns:
             A tuple consisting of the command return code, stdout, and stderr.
+            The return code is TIMEOUT_RETCODE (124) if the command timed out,
+            with the output read before the timeout.
             None on error.
 
         Example:
@@ -111,334 +904,2507 @@ class Connectible(object):
 
                 >>> from glusto.core import Glusto as g
                 >>> results = g.run("bunkerhill", "uname -a")
+
+            To give up on a hung mount after two minutes...
+
+                >>> retcode, _, _ = g.run(
+                ...     "bunkerhill",
+                ...     "mount -t glusterfs bunkerhill:/vol /mnt",
+                ...     timeout=120)
+                >>> retcode == g.TIMEOUT_RETCODE
+                True
+
+            To keep a huge output on disk instead of in memory...
+
+                >>> import mmap
+                >>> retcode, stdout, stderr = g.run("bunkerhill", "dmesg",
+                ...                                 capture='file')
+                >>> output = mmap.mmap(stdout.fileno(), 0,
+                ...                    access=mmap.ACCESS_READ)
+
+            To reuse the result of a topology query for 30 seconds...
+
+                >>> results = g.run("bunkerhill", "gluster volume info",
+                ...                 cache_ttl=30)
         """
         '''
         if isinstance(hosts, str):
             ssh = cls._get_ssh_connection(hosts, user)
 
 
-        results = {}
-        for host in hosts:
-            ssh = cls._get_ssh_connection(host, user)
-            results[ssh] = "result from %s on %s" % (command, ssh)
-        '''
+        results = {}
+        for host in hosts:
+            ssh = cls._get_ssh_connection(host, user)
+            results[ssh] = "result from %s on %s" % (command, ssh)
+        '''
+        if not user:
+            user = cls.user
+
+        ctlpersist = ''
+        if cls.use_controlpersist:
+            ctlpersist = " (cp)"
+
+        capture = cls._get_capture(capture)
+        # file objects can only be read once. don't cache them.
+        if capture == 'file':
+            cache_ttl = None
+        cache_key = (user, host, command)
+        if cache_ttl:
+            result = cls._run_cache.get(cache_key)
+            if result is not None:
+                cls.log.info("%s@%s (cached): %s", user, host, command)
+                cls._log_results("%s@%s (cached)" % (user, host), *result,
+                                 log_level=log_level)
+                return result
+
+        # output command
+        cls.log.info("%s@%s%s: %s", user, host, ctlpersist, command)
+        # run the command on the least busy channel
+        channel = cls._ssh_checkout_channel(host, user)
+        try:
+            ssh = cls._get_ssh_connection(host, user, channel)
+            if not ssh:
+                cls.log.error("ERROR: No ssh connection")
+                return (42, None, "ERROR: No ssh connection")
+
+            p = cls._popen(ssh, host, user, command,
+                           timeout=cls._get_timeout(timeout))
+            retcode, stdout, stderr = \
+                cls._communicate(p, timeout=p.timeout, capture=capture)
+            cls.metrics_observe('command_seconds', 'run', host,
+                                time.time() - p.start_time)
+        finally:
+            cls._ssh_checkin_channel(host, user, channel)
+
+        # output command results
+        identifier = "%s@%s" % (user, host)
+        cls._log_results(identifier, retcode, stdout, stderr,
+                         log_level=log_level)
+
+        if cache_ttl and retcode == 0:
+            cls._run_cache.set(cache_key, (retcode, stdout, stderr),
+                               cache_ttl,
+                               max_size=cls.config.get('run_cache_size',
+                                                       cls.run_cache_size))
+
+        return (retcode, stdout, stderr)
+
+    @classmethod
+    def run_cache_invalidate(cls, host=None, command=None, user=None):
+        """Remove command results cached by run() with a cache_ttl.
+
+        Call after changing what a cached command reports
+        (e.g., after creating a volume, invalidate "gluster volume info").
+        With no arguments, the whole cache is cleared.
+
+        Args:
+            host (optional[str]): Only remove results for this host.
+            command (optional[str]): Only remove results for this command.
+            user (optional[str]): Only remove results for this user.
+
+        Returns:
+            The number of results removed.
+
+        Example:
+            >>> from glusto.core import Glusto as g
+            >>> g.run_cache_invalidate(command="gluster volume info")
+            3
+        """
+        return cls._run_cache.invalidate(host=host, command=command,
+                                         user=user)
+
+    @classmethod
+    def run_cache_stats(cls):
+        """Get the counters for the run() result cache.
+
+        Args:
+            None
+
+        Returns:
+            A dictionary of 'hits', 'misses', 'expired', and 'evictions'
+            counts, and the number of results currently cached ('size').
+        """
+        stats = dict(cls._run_cache.stats)
+        stats['size'] = len(cls._run_cache)
+
+        return stats
+
+    @classmethod
+    def session(cls, host, user=None):
+        """Open a long-lived shell session on a remote system.
+
+        Each run() sends a command to the same remote shell, so it costs
+        a single round-trip instead of starting a new remote process,
+        and the working directory and environment carry over between
+        commands.
+
+        Args:
+            host (str): The hostname of the system.
+            user (optional[str]): The user to use for connection.
+
+        Returns:
+            A RemoteSession object. Use run() to run commands and close()
+            (or a with statement) to exit the shell.
+
+        Example:
+            >>> from glusto.core import Glusto as g
+            >>> with g.session("bunkerhill") as session:
+            ...     session.run("cd /var/log/glusterfs")
+            ...     session.run("export LC_ALL=C")
+            ...     retcode, stdout, stderr = session.run("ls")
+
+        Note:
+            A command that exits the shell (or never completes) ends the
+            session. A new shell is started by the next run(), without the
+            working directory and environment of the old one.
+        """
+        if not user:
+            user = cls.user
+
+        return RemoteSession(cls, host, user)
+
+    @classmethod
+    def run_batch(cls, host, commands, user=None, stop_on_failure=False,
+                  log_level=None, timeout=None):
+        """Run a list of commands on a remote host in a single ssh exec.
+
+        Each command runs in its own subshell. Output is framed with
+        unique markers, so the results of each command are returned
+        separately.
+
+        Args:
+            host (str): The hostname of the system.
+            commands (list): The commands to run on the system (in order).
+            user (optional[str]): The user to use for connection.
+            stop_on_failure (optional[bool]): Stop running commands after
+                the first command with a non-zero return code.
+            log_level (optional[str]): only log stdout/stderr at this level.
+            timeout (optional[int]): Seconds to wait on the whole batch
+                before killing it. See run().
+
+        Returns:
+            A list of tuples containing returncode, stdout, and stderr
+            for each command run. With stop_on_failure, the list ends
+            with the command that failed. If the batch timed out, the list
+            ends with the command that was running (with TIMEOUT_RETCODE).
+
+        Example:
+            >>> from glusto.core import Glusto as g
+            >>> results = g.run_batch("bunkerhill", ["mkdir -p /mnt/test",
+            ...                                     "uname -r",
+            ...                                     "rpm -q glusterfs"])
+            >>> for retcode, stdout, stderr in results:
+            ...     print retcode, stdout
+        """
+        if not user:
+            user = cls.user
+
+        marker = "__glusto_batch_%s__" % uuid.uuid4().hex
+        script = []
+        for i, command in enumerate(commands):
+            script.append("printf '%%s %%d\\n' %s %d" % (marker, i))
+            script.append("printf '%%s %%d\\n' %s %d >&2" % (marker, i))
+            script.append("(\n%s\n) </dev/null" % command)
+            script.append("__glusto_rc=$?")
+            script.append("printf '\\n%%s %%d %%d\\n' %s %d $__glusto_rc" %
+                          (marker, i))
+            script.append("printf '\\n%%s %%d\\n' %s %d >&2" % (marker, i))
+            if stop_on_failure:
+                script.append('[ $__glusto_rc -eq 0 ] || exit $__glusto_rc')
+        script = "\n".join(script)
+
+        ctlpersist = ''
+        if cls.use_controlpersist:
+            ctlpersist = " (cp)"
+
+        # output commands
+        cls.log.info("%s@%s%s: batch of %i commands",
+                     user, host, ctlpersist, len(commands))
+        for i, command in enumerate(commands):
+            cls.log.info("%s@%s%s [%i]: %s", user, host, ctlpersist,
+                         i, command)
+
+        # run the commands on the least busy channel
+        channel = cls._ssh_checkout_channel(host, user)
+        try:
+            ssh = cls._get_ssh_connection(host, user, channel)
+            if not ssh:
+                cls.log.error("ERROR: No ssh connection")
+                return [(42, None, "ERROR: No ssh connection")] * \
+                    len(commands)
+
+            p = cls._popen(ssh, host, user, script,
+                           timeout=cls._get_timeout(timeout))
+            retcode, stdout, stderr = cls._communicate(p, timeout=p.timeout)
+            cls.metrics_observe('command_seconds', 'run_batch', host,
+                                time.time() - p.start_time)
+        finally:
+            cls._ssh_checkin_channel(host, user, channel)
+
+        # split the framed output into results for each command
+        results = []
+        for i in range(len(commands)):
+            start = "%s %d\n" % (marker, i)
+            out_start = stdout.find(start)
+            err_start = stderr.find(start)
+            if out_start < 0:
+                break
+
+            out_start += len(start)
+            err_start += len(start)
+            out_end = re.compile(r"\n%s %d (-?\d+)\n" % (marker, i))
+            match = out_end.search(stdout, out_start)
+            err_end = stderr.find("\n%s %d\n" % (marker, i), err_start)
+            if not match:
+                # the batch died while running this command
+                results.append((retcode, stdout[out_start:],
+                                stderr[err_start:]))
+                break
+
+            results.append((int(match.group(1)),
+                            stdout[out_start:match.start()],
+                            stderr[err_start:err_end]))
+
+        # output command results
+        for i, (rcode, rout, rerr) in enumerate(results):
+            identifier = "%s@%s [%i]" % (user, host, i)
+            cls._log_results(identifier, rcode, rout, rerr,
+                             log_level=log_level)
+
+        return results
+
+    @classmethod
+    def _log_results(cls, identifier, retcode, stdout, stderr, log_level=None):
+        """Logs the return code, stdout, and stderr returned from a command.
+
+        Args:
+            identifier (str): A representative name for the messages to be
+                displayed in the log entry.
+            retcode (str): the return code from the command results.
+            stdout (str|file): the stdout from the command results.
+            stderr (str|file): the stderr from the command results.
+            log_level (optional[str]): only log stdout/stderr at this level.
+
+        Returns:
+            Nothing
+
+        Note:
+            At most log_output_limit bytes (from the config) of stdout and
+            stderr are written to the log. Output captured to a file is
+            logged up to 64KB by default.
+
+            Messages are only formatted if a handler will write them.
+            The output is passed to the logger as an argument,
+            so no copies of it are built here.
+        """
+        log_levels = {'CRITICAL': 50, 'ERROR': 40,
+                      'WARNING': 30, 'INFO': 20,
+                      'DEBUG': 10, 'NOTSET': 0}
+
+        if log_level is not None:
+            level = log_levels[log_level]
+        else:
+            level = log_levels['INFO']
+
+        # output command results
+        if cls._log_enabled(log_levels['INFO']):
+            color_start, color_end = cls.colorfy_codes(cls.COLOR_RCODE)
+            cls.log.info("%sRETCODE (%s): %s%s", color_start, identifier,
+                         retcode, color_end)
+
+        if not cls._log_enabled(level):
+            return
+
+        for name, output, color in (('STDOUT', stdout, cls.COLOR_STDOUT),
+                                    ('STDERR', stderr, cls.COLOR_STDERR)):
+            output = cls._log_output(output)
+            if output:
+                color_start, color_end = cls.colorfy_codes(color)
+                cls.log.log(level, "%s%s (%s)...\n%s%s", color_start, name,
+                            identifier, output, color_end)
+
+    @classmethod
+    def _log_enabled(cls, level):
+        """Check whether a message at a level would be written to the log.
+
+        Args:
+            level (int): The numeric log level.
+
+        Returns:
+            True if the log and at least one of its handlers accept the level.
+        """
+        if not cls.log.isEnabledFor(level):
+            return False
+
+        return any(level >= handler.level for handler in cls.log.handlers)
+
+    @classmethod
+    def _log_output(cls, output):
+        """Trim command output to the amount to be logged.
+
+        Args:
+            output (str|file): The stdout or stderr from the command results.
+
+        Returns:
+            The output (str) to log.
+        """
+        if not output:
+            return output
+
+        limit = cls.config.get('log_output_limit')
+        if hasattr(output, 'read'):
+            # don't read a spilled output file back into memory
+            limit = limit or 65536
+            size = os.fstat(output.fileno()).st_size
+            text = output.read(limit)
+            output.seek(0)
+        else:
+            size = len(output or '')
+            text = output
+            if limit:
+                text = output[:limit]
+
+        if size > len(text):
+            text += "\n... [%i more bytes not logged]" % (size - len(text))
+
+        return text
+
+    @classmethod
+    def run_async(cls, host, command, user=None, log_level=None,
+                  timeout=None, capture=None, killable=False):
+        """Run remote commands asynchronously.
+
+        Args:
+            host (str): The hostname of the system.
+            command (str): The command to run on the system.
+            user (optional[str]): The user to use for connection.
+            log_level (optional[str]): only log stdout/stderr at this level.
+            timeout (optional[int]): Seconds from the start of the command
+                before it is killed. See run().
+            capture (optional[int|str]): Limit the output kept in memory.
+                See run().
+            killable (optional[bool]): Make async_cancel() also kill the
+                command on the remote system when there is no timeout.
+                (Commands with a timeout are always killable.)
+
+        Returns:
+            An open connection descriptor to be used by the calling function.
+            None on error.
+
+        Example:
+            To run a command asynchronously on remote hosts
+            named "bunkerhill" and "breedshill"...
+
+                >>> from glusto.core import Glusto as g
+
+                >>> command = "ls -R /etc"
+                >>> proc1 = g.run_async("bunkerhill", command)
+                >>> proc2 = g.run_async("breedshill", command)
+
+                >>> results1 = proc1.async_communicate()
+                >>> results2 = proc2.async_communicate()
+
+            This can also be used to run a command against the same system
+            asynchronously as different users...
+
+                >>> command = "ls -R /etc"
+                >>> proc1 = g.run_async("breedshill", command, user="howe")
+                >>> proc2 = g.run_async("breedshill", command, user="pigot")
+
+                >>> results1 = proc1.async_communicate()
+                >>> results2 = proc2.async_communicate()
+
+            async_communicate() accepts an optional timeout (in seconds).
+            The command is killed if it has not completed in time.
+
+                >>> results = proc1.async_communicate(timeout=60)
+
+            To cancel a command (and the processes it started on the remote
+            system), then collect any output it returned...
+
+                >>> proc1.async_cancel()
+                >>> results1 = proc1.async_communicate()
+
+        Note:
+            run_async() runs commands asynchronously, but blocks on
+            async_communicate() and reads output sequentially.
+            This might not be a good fit for run-and-forget commands."""
+        if not user:
+            user = cls.user
+
+        ctlpersist = ''
+        if cls.use_controlpersist:
+            ctlpersist = " (cp)"
+
+        # output command
+        color_start, color_end = cls.colorfy_codes(cls.COLOR_COMMAND)
+        cls.log.info("%s%s@%s%s: %s%s", color_start, user, host, ctlpersist,
+                     command, color_end)
+        # run the command on the least busy channel
+        channel = cls._ssh_checkout_channel(host, user)
+        ssh = cls._get_ssh_connection(host, user, channel)
+        if not ssh:
+            cls._ssh_checkin_channel(host, user, channel)
+            print "ERROR: No ssh connection"
+            return None
+
+        try:
+            p = cls._popen(ssh, host, user, command,
+                           timeout=cls._get_timeout(timeout),
+                           killable=killable)
+        except:
+            cls._ssh_checkin_channel(host, user, channel)
+            raise
+
+        checked_in = []
+
+        def async_complete(retcode, stdout, stderr):
+            # release the channel (once) and output command results
+            if not checked_in:
+                checked_in.append(True)
+                cls._ssh_checkin_channel(host, user, channel)
+                cls.metrics_observe('command_seconds', 'run_async', host,
+                                    time.time() - p.start_time)
+
+            identifier = "%s@%s" % (user, host)
+            cls._log_results(identifier, retcode, stdout, stderr,
+                             log_level=log_level)
+
+        def async_communicate(timeout=None):
+            if not timeout and p.deadline:
+                # whatever is left of the timeout given to run_async()
+                timeout = max(p.deadline - time.time(), 0.001)
+            retcode, stdout, stderr = cls._communicate(p, timeout=timeout,
+                                                       capture=p.capture)
+            async_complete(retcode, stdout, stderr)
+
+            return (retcode, stdout, stderr)
+
+        def async_cancel():
+            cls._kill_proc(p)
+
+        p.capture = cls._get_capture(capture)
+        p.async_complete = async_complete
+        p.async_communicate = async_communicate
+        p.async_cancel = async_cancel
+        return p
+
+    @classmethod
+    def arun(cls, host, command, user=None, log_level=None, timeout=None,
+             capture=None, killable=False):
+        """Start a remote command without blocking.
+
+        The command is started the same as run_async(). Collect the results
+        with arun_gather() to read many commands from one poll loop
+        instead of blocking on each command in turn.
+
+        Args:
+            host (str): The hostname of the system.
+            command (str): The command to run on the system.
+            user (optional[str]): The user to use for connection.
+            log_level (optional[str]): only log stdout/stderr at this level.
+            timeout (optional[int]): Seconds from the start of the command
+                before it is killed. See run().
+            capture (optional[int|str]): Limit the output kept in memory.
+                See run().
+            killable (optional[bool]): See run_async().
+
+        Returns:
+            A running command handle to pass to arun_gather().
+            None on error.
+
+        Example:
+            To overlap different commands on different hosts...
+
+                >>> from glusto.core import Glusto as g
+                >>> proc1 = g.arun("bunkerhill", "gluster volume info")
+                >>> proc2 = g.arun("breedshill", "df -h")
+                >>> results1, results2 = g.arun_gather([proc1, proc2])
+
+        Note:
+            Python 2.x has no asyncio. arun() and friends multiplex output
+            with select/poll in the calling thread, so no threads are used.
+        """
+        return cls.run_async(host, command, user=user, log_level=log_level,
+                             timeout=timeout, capture=capture,
+                             killable=killable)
+
+    @classmethod
+    def arun_gather(cls, procs):
+        """Wait on commands started with arun() from a single poll loop.
+
+        Args:
+            procs (list): A list of handles returned by arun().
+
+        Returns:
+            A list of tuples containing returncode, stdout, and stderr
+            in the same order as the list of handles.
+        """
+        starters = [(i, lambda proc=proc: proc) for i, proc in
+                    enumerate(procs)]
+
+        results = [None] * len(procs)
+        for i, result in cls._poll_completions(starters):
+            results[i] = result
+
+        return results
+
+    @classmethod
+    def arun_many(cls, hosts, command, user=None, concurrency=None,
+                  log_level=None, timeout=None, capture=None):
+        """Run a command against a list of hosts from a single poll loop.
+
+        Args:
+            hosts (list): A list of hostnames to run command against.
+            command (str): The command to run on the system.
+            user (optional[str]): The user to use for connection.
+            concurrency (optional[int]): The maximum number of commands
+                in flight at the same time.
+                Defaults to max_workers in the config (or 32).
+            log_level (optional[str]): only log stdout/stderr at this level.
+            timeout (optional[int]): Seconds to wait on each host before
+                killing the command. See run().
+            capture (optional[int|str]): Limit the output kept in memory.
+                See run().
+
+        Returns:
+            A dictionary of tuples containing returncode, stdout, and stderr.
+            Labeled by the host.
+
+        Example:
+            >>> from glusto.core import Glusto as g
+            >>> results = g.arun_many(g.config['nodes'], "hostname -f",
+            ...                       concurrency=50)
+        """
+        def starter(host):
+            return lambda: cls.arun(host, command, user=user,
+                                    log_level=log_level, timeout=timeout,
+                                    capture=capture)
+
+        starters = [(host, starter(host)) for host in hosts]
+        concurrency = cls._get_max_workers(concurrency, len(starters))
+
+        results = {}
+        for host, result in cls._poll_completions(starters, concurrency):
+            results[host] = result
+
+        return results
+
+    @classmethod
+    def _poll_completions(cls, starters, concurrency=None):
+        """Run commands from a single poll loop and collect their results.
+
+        Args:
+            starters (list): A list of (key, start) tuples. start() is called
+                to start the command and returns a run_async() handle.
+            concurrency (optional[int]): The maximum number of commands
+                in flight at the same time. Defaults to no limit.
+
+        Returns:
+            A generator yielding (key, (returncode, stdout, stderr)) tuples
+            in completion order. Commands are killed when they pass their
+            timeout. Closing the generator early kills any commands
+            still running.
+        """
+        pending = deque(starters)
+        poller = _OutputPoller()
+        running = {}
+        submitted = time.time()
+        try:
+            while pending or running:
+                while pending and (not concurrency or
+                                   len(running) < concurrency):
+                    key, start = pending.popleft()
+                    if isinstance(key, basestring):
+                        cls.metrics_observe('queue_wait_seconds', 'arun',
+                                            key, time.time() - submitted)
+                    proc = start()
+                    if not proc:
+                        yield (key, (42, None, "ERROR: No ssh connection"))
+                        continue
+                    # nothing is sent to the command. close its stdin,
+                    # so a read gets end of file (the same as run()).
+                    if proc.stdin:
+                        proc.stdin.close()
+                    poller.add(key, proc)
+                    running[key] = (proc, _OutputCapture(proc.capture),
+                                    _OutputCapture(proc.capture))
+
+                if not running:
+                    continue
+
+                wait = cls._expire_procs(proc for proc, _, _ in
+                                         running.values())
+                for key, stream, data in poller.poll(wait):
+                    proc, stdout, stderr = running[key]
+                    if stream == 'stdout':
+                        stdout.write(data)
+                    elif stream == 'stderr':
+                        stderr.write(data)
+                    else:
+                        del running[key]
+                        if proc.timed_out:
+                            data = cls.TIMEOUT_RETCODE
+                        result = (data, stdout.getvalue(), stderr.getvalue())
+                        proc.async_complete(*result)
+                        yield (key, result)
+        finally:
+            # (a command can complete in the batch of events
+            # the caller stopped in)
+            killed = [poller.remove(key) for key in running if key in poller]
+            cls._kill_procs(killed)
+            for proc, _, _ in running.values():
+                proc.wait()
+                proc.async_complete(proc.returncode, None, None)
+
+    @classmethod
+    def run_until(cls, hosts, command, condition='any', user=None,
+                  concurrency=None, timeout=None, log_level=None):
+        """Run a command against a list of hosts until a condition is decided.
+
+        Results are checked as each host completes. As soon as the outcome
+        is known, the commands still running are cancelled (on the remote
+        systems too) instead of waiting on the slowest hosts.
+
+        Args:
+            hosts (list): A list of hostnames to run command against.
+            command (str): The command to run on the systems.
+            condition (optional[str|callable]): When to stop.
+                'any': one host returns zero (default).
+                'all': every host returns zero. Stops at the first failure.
+                'quorum': more than half of the hosts return zero.
+                A callable is passed the dictionary of results so far and
+                returns True (satisfied), False (failed), or None (not
+                decided yet).
+            user (optional[str]): The user to use for connection.
+            concurrency (optional[int]): The maximum number of commands
+                in flight at the same time.
+                Defaults to max_workers in the config (or 32).
+            timeout (optional[int]): Seconds to wait on each host before
+                killing the command. See run().
+            log_level (optional[str]): only log stdout/stderr at this level.
+
+        Returns:
+            A tuple of True (satisfied) or False (failed) and a dictionary of
+            tuples containing returncode, stdout, and stderr for the hosts
+            that completed. Labeled by the host.
+            Cancelled hosts are not in the dictionary.
+            None on error.
+
+        Example:
+            To check whether the volume is started on any node...
+
+                >>> from glusto.core import Glusto as g
+                >>> started, results = g.run_until(
+                ...     g.config['nodes'],
+                ...     "gluster volume status testvol | grep -q Online",
+                ...     condition='any')
+
+            To stop as soon as two hosts have seen the peer...
+
+                >>> def two_seen(results):
+                ...     seen = [r for r in results.values() if r[0] == 0]
+                ...     return True if len(seen) >= 2 else None
+                >>> seen, results = g.run_until(hosts, "gluster peer status",
+                ...                             condition=two_seen)
+        """
+        hosts = list(hosts)
+        decide = cls._until_condition(condition, len(hosts))
+        if not decide:
+            cls.log.error("Unknown run_until condition: %s" % condition)
+            return None
+
+        def starter(host):
+            return lambda: cls.arun(host, command, user=user,
+                                    log_level=log_level, timeout=timeout,
+                                    killable=True)
+
+        starters = [(host, starter(host)) for host in hosts]
+        concurrency = cls._get_max_workers(concurrency, len(starters))
+
+        results = {}
+        satisfied = None
+        completions = cls._poll_completions(starters, concurrency)
+        try:
+            for host, result in completions:
+                results[host] = result
+                satisfied = decide(results)
+                if satisfied is not None:
+                    break
+        finally:
+            # cancels the commands still running
+            completions.close()
+
+        if satisfied is None:
+            satisfied = decide(results)
+        satisfied = bool(satisfied)
+
+        cancelled = [host for host in hosts if host not in results]
+        cls.log.info("run_until %s: %s after %i of %i hosts "
+                     "(%i cancelled)", condition,
+                     "satisfied" if satisfied else "failed",
+                     len(results), len(hosts), len(cancelled))
+
+        return (satisfied, results)
+
+    @staticmethod
+    def _until_condition(condition, num_hosts):
+        """Build the decision function for run_until().
+
+        Args:
+            condition (str|callable): 'any', 'all', 'quorum', or a callable.
+            num_hosts (int): The number of hosts the command runs against.
+
+        Returns:
+            A function taking the results so far and returning
+            True, False, or None (not decided). None if the condition
+            is unknown.
+        """
+        if callable(condition):
+            return condition
+
+        needed = {'any': 1,
+                  'all': num_hosts,
+                  'quorum': num_hosts // 2 + 1}.get(condition)
+        if needed is None:
+            return None
+
+        def decide(results):
+            passed = len([result for result in results.values()
+                          if result[0] == 0])
+            failed = len(results) - passed
+            if passed >= needed:
+                return True
+            if num_hosts - failed < needed:
+                return False
+            return None
+
+        return decide
+
+    @classmethod
+    def wait_for(cls, hosts, command, predicate=None, interval=1, timeout=300,
+                 backoff=1.5, max_interval=30, jitter=0.25, user=None,
+                 concurrency=None, log_level=None):
+        """Poll a command on a list of hosts until each one is ready.
+
+        All hosts are polled from a single poll loop on the existing
+        connections. The delay between polls of a host grows by backoff
+        (with random jitter so hosts do not poll in lockstep), and a host
+        is no longer polled once it is ready.
+
+        Args:
+            hosts (list|str): A hostname or list of hostnames.
+            command (str): The command to poll on the systems.
+            predicate (optional[callable]): Called with the (returncode,
+                stdout, stderr) tuple of each poll and returns True when
+                the host is ready. Defaults to a returncode of zero.
+            interval (optional[float]): Seconds between the first polls.
+            timeout (optional[float]): Seconds to wait for all hosts.
+                Commands still running at the timeout are killed.
+            backoff (optional[float]): The interval is multiplied by this
+                after each poll that is not ready. 1 polls at a fixed rate.
+            max_interval (optional[float]): The largest interval.
+            jitter (optional[float]): The fraction each delay is randomly
+                shortened or lengthened by.
+            user (optional[str]): The user to use for connection.
+            concurrency (optional[int]): The maximum number of polls
+                in flight at the same time.
+                Defaults to max_workers in the config (or 32).
+            log_level (optional[str]): only log stdout/stderr at this level.
+
+        Returns:
+            A tuple of True (all hosts ready) or False and a dictionary
+            labeled by host with...
+                ready: True if the host became ready.
+                seconds: Seconds until the host was ready (None if not).
+                attempts: The number of polls.
+                result: The (returncode, stdout, stderr) of the last poll.
+
+        Example:
+            To wait for glusterd to come up on every node...
+
+                >>> from glusto.core import Glusto as g
+                >>> ready, report = g.wait_for(g.config['nodes'],
+                ...                            "systemctl is-active glusterd",
+                ...                            timeout=120)
+
+            To wait for self-heal to complete...
+
+                >>> def healed(result):
+                ...     return result[0] == 0 and \\
+                ...         "Number of entries: 0" in result[1]
+                >>> ready, report = g.wait_for(
+                ...     nodes, "gluster volume heal testvol info",
+                ...     predicate=healed, interval=5, timeout=1800)
+        """
+        if isinstance(hosts, basestring):
+            hosts = [hosts]
+        hosts = list(hosts)
+        if predicate is None:
+            predicate = lambda result: result[0] == 0
+        concurrency = cls._get_max_workers(concurrency, len(hosts))
+        command_timeout = cls._get_timeout()
+
+        start = time.time()
+        deadline = start + timeout
+        report = dict((host, {'ready': False, 'seconds': None,
+                              'attempts': 0, 'result': None})
+                      for host in hosts)
+        # next poll time and current interval of each host waiting to poll
+        idle = OrderedDict((host, (start, interval)) for host in hosts)
+        poller = _OutputPoller()
+        running = {}
+
+        def reschedule(host, current):
+            delay = current * random.uniform(1 - jitter, 1 + jitter)
+            idle[host] = (time.time() + delay,
+                          min(current * backoff, max_interval))
+
+        try:
+            while idle or running:
+                now = time.time()
+                if now >= deadline:
+                    break
+
+                for host, (next_poll, current) in idle.items():
+                    if len(running) >= concurrency:
+                        break
+                    if next_poll > now:
+                        continue
+                    del idle[host]
+                    report[host]['attempts'] += 1
+                    attempt_timeout = deadline - now
+                    if command_timeout:
+                        attempt_timeout = min(attempt_timeout,
+                                              command_timeout)
+                    proc = cls.arun(host, command, user=user,
+                                    log_level=log_level,
+                                    timeout=attempt_timeout)
+                    if not proc:
+                        report[host]['result'] = \
+                            (42, None, "ERROR: No ssh connection")
+                        reschedule(host, current)
+                        continue
+                    # nothing is sent to the command. close its stdin,
+                    # so a read gets end of file (the same as run()).
+                    if proc.stdin:
+                        proc.stdin.close()
+                    poller.add(host, proc)
+                    running[host] = (proc, current,
+                                     _OutputCapture(proc.capture),
+                                     _OutputCapture(proc.capture))
+
+                wait = deadline - now
+                for next_poll, _ in idle.values():
+                    wait = min(wait, next_poll - now)
+                expire = cls._expire_procs(proc for proc, _, _, _ in
+                                           running.values())
+                if expire is not None:
+                    wait = min(wait, expire)
+                wait = max(wait, 0)
+
+                if not running:
+                    time.sleep(wait)
+                    continue
+
+                for host, stream, data in poller.poll(wait):
+                    proc, current, stdout, stderr = running[host]
+                    if stream == 'stdout':
+                        stdout.write(data)
+                    elif stream == 'stderr':
+                        stderr.write(data)
+                    else:
+                        del running[host]
+                        if proc.timed_out:
+                            data = cls.TIMEOUT_RETCODE
+                        result = (data, stdout.getvalue(), stderr.getvalue())
+                        proc.async_complete(*result)
+                        report[host]['result'] = result
+                        if predicate(result):
+                            report[host]['ready'] = True
+                            report[host]['seconds'] = time.time() - start
+                        else:
+                            reschedule(host, current)
+        finally:
+            cls._kill_procs([poller.remove(host) for host in running
+                             if host in poller])
+            for host, (proc, _, _, _) in running.items():
+                proc.wait()
+                proc.async_complete(proc.returncode, None, None)
+                report[host]['result'] = (cls.TIMEOUT_RETCODE, None, None)
+
+        for host in hosts:
+            host_report = report[host]
+            if host_report['ready']:
+                cls.log.info("wait_for: %s ready after %.2fs (%i polls)",
+                             host, host_report['seconds'],
+                             host_report['attempts'])
+            else:
+                cls.log.warning("wait_for: %s not ready after %.2fs "
+                                "(%i polls)", host, time.time() - start,
+                                host_report['attempts'])
+
+        ready = all(host_report['ready'] for host_report in report.values())
+
+        return (ready, report)
+
+    @classmethod
+    def run_rolling(cls, hosts, command, batch_size=1, delay=0,
+                    health_check=None, health_timeout=300, max_failures=0,
+                    progress_callback=None, user=None, timeout=None,
+                    log_level=None):
+        """Run a command against a list of hosts one batch at a time.
+
+        The hosts in a batch run the command in parallel (from a single
+        poll loop). The next batch starts when the batch before it is done
+        and healthy, so a cluster-wide restart or heavy I/O job never hits
+        more than a batch of nodes at once.
+
+        Args:
+            hosts (list): A list of hostnames to run command against.
+            command (str): The command to run on the systems.
+            batch_size (optional[int|str]): The number of hosts in a batch,
+                or a percentage of the hosts (e.g., '10%'). Defaults to 1.
+            delay (optional[float]): Seconds to wait between batches.
+            health_check (optional[str]): A command polled on the hosts of
+                a batch (see wait_for()) until it returns zero before the
+                next batch starts. Hosts that are not healthy within
+                health_timeout seconds count as failed.
+            health_timeout (optional[float]): Seconds to wait for the hosts
+                of a batch to pass the health_check.
+            max_failures (optional[int]): The number of failed hosts allowed
+                before the rollout is aborted. The batch running at the time
+                is finished and no more batches are started.
+                Defaults to 0 (abort after the first batch with a failure).
+            progress_callback (optional[callable]): Called after each batch
+                with a dictionary of batch (number), batches (total),
+                hosts (in the batch), done (number of hosts run),
+                total (number of hosts), and failed (list of hosts).
+            user (optional[str]): The user to use for connection.
+            timeout (optional[int]): Seconds to wait on each host before
+                killing the command. See run().
+            log_level (optional[str]): only log stdout/stderr at this level.
+
+        Returns:
+            A tuple of...
+                True if every batch ran. False if the rollout was aborted.
+                A dictionary of tuples containing returncode, stdout, and
+                    stderr for the hosts that ran the command.
+                    Labeled by the host.
+                A list of the hosts where the command or health_check failed.
+            None on error.
+
+        Example:
+            To restart glusterd on 10% of the nodes at a time,
+            waiting for each batch to come back up...
+
+                >>> from glusto.core import Glusto as g
+                >>> completed, results, failed = g.run_rolling(
+                ...     g.config['nodes'], "systemctl restart glusterd",
+                ...     batch_size='10%', delay=5,
+                ...     health_check="systemctl is-active glusterd",
+                ...     max_failures=2)
+        """
+        hosts = list(hosts)
+        size = cls._rolling_batch_size(batch_size, len(hosts))
+        if not size:
+            cls.log.error("Invalid run_rolling batch_size: %s" % batch_size)
+            return None
+
+        batches = [hosts[i:i + size] for i in range(0, len(hosts), size)]
+        results = {}
+        failed = []
+        completed = True
+        for number, batch in enumerate(batches, 1):
+            if number > 1 and delay:
+                time.sleep(delay)
+
+            batch_results = cls.arun_many(batch, command, user=user,
+                                          concurrency=len(batch),
+                                          log_level=log_level,
+                                          timeout=timeout)
+            results.update(batch_results)
+            batch_failed = [host for host in batch
+                            if batch_results[host][0] != 0]
+
+            if health_check:
+                ran = [host for host in batch if host not in batch_failed]
+                if ran:
+                    _, report = cls.wait_for(ran, health_check, user=user,
+                                             timeout=health_timeout,
+                                             log_level=log_level)
+                    batch_failed.extend(host for host in ran
+                                        if not report[host]['ready'])
+
+            failed.extend(batch_failed)
+            cls.log.info("run_rolling: batch %i of %i done "
+                         "(%i of %i hosts, %i failed)", number, len(batches),
+                         len(results), len(hosts), len(failed))
+
+            if progress_callback:
+                progress_callback({'batch': number,
+                                   'batches': len(batches),
+                                   'hosts': batch,
+                                   'done': len(results),
+                                   'total': len(hosts),
+                                   'failed': list(failed)})
+
+            if len(failed) > max_failures:
+                completed = False
+                cls.log.error("run_rolling: aborted after %i failed hosts "
+                              "(max_failures %i): %s. %i hosts not run.",
+                              len(failed), max_failures, ", ".join(failed),
+                              len(hosts) - len(results))
+                break
+
+        return (completed, results, failed)
+
+    @staticmethod
+    def _rolling_batch_size(batch_size, num_hosts):
+        """Determine the number of hosts in each batch of run_rolling().
+
+        Args:
+            batch_size (int|str): A number of hosts or a percentage
+                of the hosts (e.g., '25%').
+            num_hosts (int): The number of hosts.
+
+        Returns:
+            The number of hosts (int). At least one.
+            None if batch_size is not valid.
+        """
+        try:
+            if isinstance(batch_size, basestring) and \
+                    batch_size.endswith('%'):
+                percent = float(batch_size[:-1])
+                if percent <= 0:
+                    return None
+                return max(1, int(math.ceil(num_hosts * percent / 100.0)))
+
+            batch_size = int(batch_size)
+        except ValueError:
+            return None
+
+        if batch_size < 1:
+            return None
+
+        return batch_size
+
+    @classmethod
+    def run_stream(cls, hosts, command, user=None, line_callback=None,
+                   max_line_length=65536, log_level=None):
+        """Run a command on one or more hosts and stream the output.
+
+        Output is read from all hosts in a single poll loop and handed back
+        a line at a time as it arrives. Output is not accumulated,
+        so memory use stays flat for long-running or verbose commands.
+
+        Args:
+            hosts (list|str): A hostname or list of hostnames.
+            command (str): The command to run on the systems.
+            user (optional[str]): The user to use for connection.
+            line_callback (optional[callable]): Called as
+                line_callback(host, stream, line) for each line of output.
+            max_line_length (optional[int]): The largest partial line
+                buffered for a stream before it is handed back as-is.
+            log_level (optional[str]): only log stdout/stderr at this level.
+
+        Returns:
+            With no line_callback, a generator yielding (host, stream, line)
+            tuples. stream is 'stdout' or 'stderr', and a final
+            (host, 'retcode', returncode) tuple is yielded for each host.
+            With a line_callback, a dictionary of return codes
+            labeled by the host.
+
+        Example:
+            To watch a long-running command on multiple hosts...
+
+                >>> from glusto.core import Glusto as g
+                >>> hosts = ["bunkerhill", "breedshill"]
+                >>> for host, stream, line in g.run_stream(hosts,
+                ...                                        "ls -R /"):
+                ...     print host, stream, line
+
+            To handle each line with a callback instead...
+
+                >>> def show(host, stream, line):
+                ...     print host, line
+                >>> retcodes = g.run_stream(hosts, "ls -R /",
+                ...                         line_callback=show)
+        """
+        events = cls._stream_events(hosts, command, user=user,
+                                    max_line_length=max_line_length,
+                                    log_level=log_level)
+        if not line_callback:
+            return events
+
+        retcodes = {}
+        for host, stream, line in events:
+            if stream == 'retcode':
+                retcodes[host] = line
+            else:
+                line_callback(host, stream, line)
+
+        return retcodes
+
+    @classmethod
+    def _stream_events(cls, hosts, command, user=None,
+                       max_line_length=65536, log_level=None):
+        """Generator behind run_stream(). See run_stream() for details."""
+        if isinstance(hosts, basestring):
+            hosts = [hosts]
+        if not user:
+            user = cls.user
+
+        poller = _OutputPoller()
+        procs = {}
+        for host in hosts:
+            proc = cls.run_async(host, command, user, log_level)
+            if not proc:
+                yield (host, 'stderr', "ERROR: No ssh connection")
+                yield (host, 'retcode', 42)
+                continue
+            # nothing is sent to the command. close its stdin,
+            # so a read gets end of file (the same as run()).
+            if proc.stdin:
+                proc.stdin.close()
+            poller.add(host, proc)
+            procs[host] = proc
+
+        partial = {}
+        try:
+            while procs:
+                wait = cls._expire_procs(procs.values())
+                for host, stream, data in poller.poll(wait):
+                    if stream == 'retcode':
+                        if procs[host].timed_out:
+                            data = cls.TIMEOUT_RETCODE
+                        # flush any unterminated lines before the retcode
+                        for name in ('stdout', 'stderr'):
+                            line = partial.pop((host, name), '')
+                            if line:
+                                yield (host, name, line)
+                        procs.pop(host).async_complete(data, None, None)
+                        yield (host, stream, data)
+                        continue
+
+                    lines = (partial.pop((host, stream), '') +
+                             data).splitlines(True)
+                    if not lines[-1].endswith('\n') and \
+                            len(lines[-1]) < max_line_length:
+                        partial[(host, stream)] = lines.pop()
+                    for line in lines:
+                        yield (host, stream, line)
+        finally:
+            # kill anything still running if the caller stopped early
+            # (a command can complete in the batch of events
+            # the caller stopped in)
+            killed = [poller.remove(host) for host in procs if host in poller]
+            cls._kill_procs(killed)
+            for proc in procs.values():
+                proc.wait()
+                proc.async_complete(proc.returncode, None, None)
+
+    @classmethod
+    def run_local(cls, command, log_level=None, capture=None):
+        """Run a command on the local management system.
+
+        Args:
+            command (str): Command to run locally.
+            log_level (optional[str]): only log stdout/stderr at this level.
+            capture (optional[int|str]): Limit the output kept in memory.
+                See run().
+
+        Returns:
+            A tuple consisting of the command return code, stdout, and stderr.
+
+        Example:
+            To run a command locally...
+
+                >>> from glusto.core import Glusto as g
+                >>> retcode, stdout, stderr = g.run_local("uname -a")
+        """
+        # output command
+        cls.log.info("local: %s" % command)
+
+        with cls.metrics_timer('command_seconds', 'run_local', 'localhost'):
+            p = subprocess.Popen(command, shell=True,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+            retcode, stdout, stderr = \
+                cls._communicate(p, capture=cls._get_capture(capture))
+
+        # output command results
+        cls._log_results('local', retcode, stdout, stderr,
+                         log_level=log_level)
+
+        return (retcode, stdout, stderr)
+
+    @classmethod
+    def run_serial(cls, hosts, command, user=None, log_level=None,
+                   timeout=None, capture=None):
+        """Sequentially runs a command against a list of hosts.
+
+        Args:
+            hosts (list): A list of hostnames to run command against.
+            command (str): The command to run on the system.
+            user (optional[str]): The user to use for connection.
+            log_level (optional[str]): only log stdout/stderr at this level.
+            timeout (optional[int]): Seconds to wait on each host before
+                killing the command. See run().
+            capture (optional[int|str]): Limit the output kept in memory.
+                See run().
+
+        Returns:
+            A dictionary of tuples containing returncode, stdout, and stderr.
+            Labeled by the host.
+
+        Example:
+            To run a command against a list of hosts...
+
+                >>> from glusto.core import Glusto as g
+                >>> hosts = ["bunkerhill", "breedshill"]
+                >>> results = g.run_serial(hosts, "ls -Rail /etc")
+        """
+        results = {}
+        for host in hosts:
+            rcode, rout, rerr = cls.run(host, command, user=user,
+                                        log_level=log_level, timeout=timeout,
+                                        capture=capture)
+
+            results[host] = (rcode, rout, rerr)
+
+        return results
+
+    @classmethod
+    def run_parallel(cls, hosts, command, user=None, log_level=None,
+                     max_workers=None, timeout=None, capture=None):
+        """Runs a command against a list of hosts in parallel.
+
+        Args:
+            hosts (list): A list of hostnames to run command against.
+            command (str): The command to run on the system.
+            user (optional[str]): The user to use for connection.
+            log_level (optional[str]): only log stdout/stderr at this level.
+            max_workers (optional[int]): The maximum number of hosts
+                to run the command against at the same time.
+                Defaults to max_workers in the config (or 32).
+            timeout (optional[int]): Seconds to wait on each host before
+                killing the command. See run().
+            capture (optional[int|str]): Limit the output kept in memory.
+                See run().
+
+        Returns:
+            A dictionary of tuples containing returncode, stdout, and stderr.
+            Labeled by the host.
+
+        Example:
+            To run a command against a list of hosts in parallel...
+
+                >>> from glusto.core import Glusto as g
+                >>> hosts = ["bunkerhill", "breedshill"]
+                >>> results = g.run_parallel(hosts, "ls -Rail /etc")
+
+            To limit the number of concurrent ssh processes...
+
+                >>> results = g.run_parallel(hosts, "ls -Rail /etc",
+                ...                          max_workers=10, timeout=300)
+        """
+        def run_on_host(host):
+            proc = cls.run_async(host, command, user, log_level,
+                                 timeout=timeout, capture=capture)
+            if not proc:
+                return (42, None, "ERROR: No ssh connection")
+
+            return proc.async_communicate()
+
+        # record results as each host completes
+        results = {}
+        for host, result in cls._parallel_map(run_on_host, hosts,
+                                              max_workers=max_workers,
+                                              operation='run_parallel'):
+            results[host] = result
+
+        return results
+
+    @classmethod
+    def _get_max_workers(cls, max_workers=None, num_items=None):
+        """Determine the number of workers for a parallel operation.
+
+        Args:
+            max_workers (optional[int]): An explicit cap on workers.
+                Defaults to max_workers in the config (or 32).
+            num_items (optional[int]): The number of items to be processed.
+                No more workers than items are started.
+
+        Returns:
+            The number of workers (int).
+        """
+        if not max_workers:
+            max_workers = cls.config.get('max_workers', cls.max_workers)
+
+        if num_items:
+            max_workers = min(max_workers, num_items)
+
+        return max(1, int(max_workers))
+
+    @classmethod
+    def _parallel_map(cls, func, items, max_workers=None, operation=None,
+                      host_of=None):
+        """Call a function against each item from a bounded pool of threads.
+
+        Args:
+            func (callable): The function to call with each item.
+            items (list): The items to pass to the function.
+            max_workers (optional[int]): The maximum number of worker threads.
+            operation (optional[str]): The operation the time each item
+                waited for a worker is recorded under (queue_wait_seconds).
+                Nothing is recorded if None.
+            host_of (optional[callable]): Returns the host of an item for
+                the metric. Defaults to the item itself.
+
+        Returns:
+            A generator yielding (item, result) tuples in completion order.
+        """
+        items = list(items)
+        if not items:
+            return
+
+        def worker(item):
+            if operation:
+                host = host_of(item) if host_of else item
+                cls.metrics_observe('queue_wait_seconds', operation, host,
+                                    time.time() - submitted)
+            return (item, func(item))
+
+        submitted = time.time()
+        pool = ThreadPool(cls._get_max_workers(max_workers, len(items)))
+        try:
+            for item_result in pool.imap_unordered(worker, items):
+                yield item_result
+        finally:
+            pool.close()
+            pool.join()
+
+    @classmethod
+    def _communicate(cls, proc, timeout=None, capture=None):
+        """Wait on a running command and collect the results.
+
+        Args:
+            proc (obj): A popen object.
+            timeout (optional[int]): Seconds to wait before killing
+                the command.
+            capture (optional[int|str]): How output is kept.
+                See _get_capture().
+
+        Returns:
+            A tuple consisting of the command return code, stdout, and stderr.
+        """
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, cls._timeout_proc,
+                                    [proc, timeout])
+            timer.daemon = True
+            timer.start()
+
+        try:
+            if capture is None:
+                stdout, stderr = proc.communicate()
+            else:
+                stdout, stderr = cls._capture_output(proc, capture)
+        finally:
+            if timer:
+                timer.cancel()
+
+        retcode = proc.returncode
+        if getattr(proc, 'timed_out', False):
+            retcode = cls.TIMEOUT_RETCODE
+
+        return (retcode, stdout, stderr)
+
+    @staticmethod
+    def _capture_output(proc, capture):
+        """Read the output of a command into _OutputCapture objects.
+
+        Args:
+            proc (obj): A popen object.
+            capture (int|str): The capture mode. See _get_capture().
+
+        Returns:
+            A tuple of the captured stdout and stderr.
+        """
+        if proc.stdin:
+            proc.stdin.close()
+
+        output = {'stdout': _OutputCapture(capture),
+                  'stderr': _OutputCapture(capture)}
+        poller = _OutputPoller()
+        poller.add(None, proc)
+        while poller:
+            for _, stream, data in poller.poll():
+                if stream in output:
+                    output[stream].write(data)
+
+        return (output['stdout'].getvalue(), output['stderr'].getvalue())
+
+    @classmethod
+    def _get_capture(cls, capture=None):
+        """Determine how the output of a command is kept.
+
+        Args:
+            capture (optional[int|str]): An explicit capture mode.
+                A number of bytes keeps at most that much of each stream
+                in memory (the head and tail, with the middle truncated).
+                'file' writes each stream to a temporary file and returns
+                the file objects instead of strings.
+
+        Returns:
+            The capture mode. Defaults to capture_limit in the config
+            (or None to keep all output in memory).
+        """
+        if capture is None:
+            capture = cls.config.get('capture_limit')
+
+        return capture or None
+
+    @classmethod
+    def _timeout_proc(cls, proc, timeout):
+        """Kill a command that has exceeded its timeout.
+
+        Args:
+            proc (obj): A popen object.
+            timeout (int): The timeout that was exceeded (for logging).
+
+        Returns:
+            Nothing
+        """
+        # don't poll() here. it races the wait() in the calling thread.
+        if proc.returncode is not None:
+            return
+
+        proc.timed_out = True
+        cls.log.error("Command timed out after %s seconds. Killing." % timeout)
+        cls._kill_proc(proc)
+
+    @classmethod
+    def _kill_proc(cls, proc):
+        """Kill a running command.
+
+        Args:
+            proc (obj): A popen object.
+
+        Returns:
+            Nothing
+        """
+        # called from timer threads too, so no poll() here
+        cls._kill_procs([proc], reap=False)
+
+    @classmethod
+    def _kill_procs(cls, procs, reap=True):
+        """Kill running commands.
+
+        The ssh clients are killed first. The commands still running on
+        the remote systems are then killed with one ssh exec per host,
+        with the hosts done in parallel.
+
+        Args:
+            procs (list): A list of popen objects.
+            reap (optional[bool]): Check whether each command has already
+                exited, and skip the remote kill for those that have.
+                Only safe from the thread that waits on the commands.
+
+        Returns:
+            Nothing
+        """
+        pidfiles = {}
+        for proc in procs:
+            exited = reap and proc.poll() is not None
+            try:
+                proc.kill()
+            except OSError:
+                # already exited
+                pass
+
+            # the remote processes keep running after the ssh client
+            # is killed
+            remote_pidfile = getattr(proc, 'remote_pidfile', None)
+            if remote_pidfile and not exited:
+                host, user, pidfile = remote_pidfile
+                # only a command that just started might not have
+                # written its pidfile yet
+                just_started = time.time() - proc.start_time < 1
+                pidfiles.setdefault((host, user), []).append(
+                    (pidfile, just_started))
+
+        def kill_remote(host_user):
+            host, user = host_user
+            cls._kill_remote(host, user, pidfiles[host_user])
+
+        if len(pidfiles) == 1:
+            kill_remote(pidfiles.keys()[0])
+            return
+
+        for _ in cls._parallel_map(kill_remote, pidfiles.keys()):
+            pass
+
+    @classmethod
+    def _get_timeout(cls, timeout=None):
+        """Determine the timeout for a command.
+
+        Args:
+            timeout (optional[int]): An explicit timeout in seconds.
+                Zero means no timeout.
+
+        Returns:
+            The timeout in seconds. None for no timeout.
+        """
+        if timeout is None:
+            timeout = cls.config.get('command_timeout')
+
+        return timeout or None
+
+    @classmethod
+    def _popen(cls, ssh, host, user, command, timeout=None, killable=False):
+        """Start a command on an ssh connection.
+
+        With a timeout (or killable), the remote shell records its process
+        group in a pidfile, so the command and everything it started can be
+        killed on the remote system (see _kill_proc()).
+
+        Args:
+            ssh (obj): An ssh connection.
+            host (str): The hostname of the system.
+            user (str): The user the connection is for.
+            command (str): The command to run on the system.
+            timeout (optional[int]): Seconds before the command is killed.
+            killable (optional[bool]): Make the command killable on the
+                remote system without a timeout.
+
+        Returns:
+            A popen object with timeout, deadline, and timed_out attributes.
+        """
+        if not timeout and not killable:
+            proc = ssh.popen(command)
+        else:
+            # sshd runs each command in a new session, so the remote
+            # shell's pid is also the process group of the command
+            pidfile = "/tmp/glusto_%s.pid" % uuid.uuid4().hex
+            proc = ssh.popen("echo $$ > %s\n(\n%s\n)\n__glusto_rc=$?\n"
+                             "rm -f %s\nexit $__glusto_rc" %
+                             (pidfile, command, pidfile))
+            proc.remote_pidfile = (host, user, pidfile)
+
+        proc.deadline = None
+        if timeout:
+            proc.deadline = time.time() + timeout
+
+        proc.timeout = timeout
+        proc.timed_out = False
+        proc.start_time = time.time()
+
+        return proc
+
+    @classmethod
+    def _kill_remote(cls, host, user, pidfiles):
+        """Kill the process groups of commands on the remote system.
+
+        Args:
+            host (str): The hostname of the system.
+            user (str): The user the commands were run as.
+            pidfiles (list): A list of (pidfile, wait) tuples. pidfile is
+                written by the command (see _popen()). With wait, give
+                the command a moment to write a missing pidfile.
+
+        Returns:
+            Nothing
+        """
+        # (the login shell can be dash, so no "kill -- -pgid")
+        script = ["rc=0"]
+        for pidfile, wait in pidfiles:
+            if wait:
+                # a command cancelled right after it started might not
+                # have written its pidfile yet
+                script.append("for i in 1 2 3 4 5; do [ -f %s ] && break; "
+                              "sleep 0.2; done" % pidfile)
+            script.append("pgid=$(cat %s 2>/dev/null) && "
+                          "kill -0 -$pgid 2>/dev/null && "
+                          "{ kill -9 -$pgid || rc=1; }; rm -f %s" %
+                          (pidfile, pidfile))
+        script.append("exit $rc")
+
+        try:
+            ssh = cls._get_ssh_connection(host, user)
+            if not ssh:
+                return
+            proc = ssh.popen("\n".join(script))
+            retcode, _, stderr = cls._communicate(proc, timeout=30)
+            if retcode:
+                cls.log.error("Killing remote command on %s failed: %s" %
+                              (host, stderr))
+        except Exception as err:
+            cls.log.error("Killing remote command on %s failed: %s" %
+                          (host, err))
+
+    @classmethod
+    def _expire_procs(cls, procs):
+        """Kill the commands that have passed their deadline.
+
+        Args:
+            procs (list): A list of popen objects started by _popen().
+
+        Returns:
+            Seconds until the next deadline. None if there is no deadline.
+        """
+        now = time.time()
+        wait = None
+        expired = []
+        for proc in procs:
+            if proc.deadline is None or proc.timed_out:
+                continue
+            if proc.deadline <= now:
+                if proc.poll() is None:
+                    proc.timed_out = True
+                    cls.log.error("Command timed out after %s seconds. "
+                                  "Killing." % proc.timeout)
+                    expired.append(proc)
+            elif wait is None or proc.deadline - now < wait:
+                wait = proc.deadline - now
+
+        cls._kill_procs(expired, reap=False)
+
+        return wait
+
+    @classmethod
+    def upload(cls, host, localpath, remotepath, user=None):
+        """Uploads a file to a remote system.
+
+        Args:
+            host (str): Hostname of the remote system.
+            localpath (str): The source path for the file on the local system.
+            remotepath (str): The target path on the remote server.
+            user (optional[str]): The user to use for the remote connection.
+
+        Returns:
+            True on success.
+            False on failure.
+        """
+        # TODO: consider a noclobber option to backup existing files
+
+        if not user:
+            user = cls.user
+
+        # run the command
+        ssh = cls._get_ssh_connection(host, user)
+        if not ssh:
+            print "ERROR: No ssh connection"
+            return False
+
+        # TODO: catch exceptions thrown by SshMachine.upload()
+        with cls.metrics_timer('transfer_seconds', 'upload', host):
+            ssh.upload(localpath, remotepath)
+        cls.metrics_observe('transfer_bytes', 'upload', host,
+                            cls._local_size(localpath))
+
+        return True
+
+    @classmethod
+    def download(cls, host, remotepath, localpath, user=None):
+        """Downloads a file from a remote system.
+
+        Args:
+            host (str): Hostname of the remote system.
+            remotepath (str): The source path on the remote server.
+            localpath (str): The target path for the file on the local system.
+            user (optional[str]): The user to use for the remote connection.
+
+        Returns:
+            True on success.
+            False on failure.
+        """
+        # TODO: consider a noclobber option to backup existing files
+
         if not user:
             user = cls.user
 
-        ctlpersist = ''
-        if cls.use_controlpersist:
-            ctlpersist = " (cp)"
-
-        # output command
-        cls.log.info("%s@%s%s: %s" % (user, host, ctlpersist, command))
         # run the command
         ssh = cls._get_ssh_connection(host, user)
         if not ssh:
-            cls.log.error("ERROR: No ssh connection")
-            return (42, None, "ERROR: No ssh connection")
-
-        p = ssh.popen(command)
-        stdout, stderr = p.communicate()
-        retcode = p.returncode
+            print "ERROR: No ssh connection"
+            return False
 
-        # output command results
-        identifier = "%s@%s" % (user, host)
-        cls._log_results(identifier, retcode, stdout, stderr,
-                         log_level=log_level)
+        # TODO: catch exceptions thrown by SshMachine.download()
+        with cls.metrics_timer('transfer_seconds', 'download', host):
+            ssh.download(remotepath, localpath)
+        if os.path.isdir(localpath):
+            localpath = os.path.join(localpath, os.path.basename(remotepath))
+        cls.metrics_observe('transfer_bytes', 'download', host,
+                            cls._local_size(localpath))
 
-        return (retcode, stdout, stderr)
+        return True
 
-    @classmethod
-    def _log_results(cls, identifier, retcode, stdout, stderr, log_level=None):
-        """Logs the return code, stdout, and stderr returned from a command.
+    @staticmethod
+    def _local_size(path):
+        """Get the total size of a local file or directory.
 
         Args:
-            identifier (str): A representative name for the messages to be
-                displayed in the log entry.
-            retcode (str): the return code from the command results.
-            stdout (str): the stdout from the command results.
-            stderr (str): the stderr from the command results.
-            log_level (optional[str]): only log stdout/stderr at this level.
+            path (str): A local file or directory.
 
         Returns:
-            Nothing
+            The size in bytes. Zero if the path does not exist.
         """
-        log_levels = {'CRITICAL': 50, 'ERROR': 40,
-                      'WARNING': 30, 'INFO': 20,
-                      'DEBUG': 10, 'NOTSET': 0}
-
-        if log_level is not None:
-            level = log_levels[log_level]
-        else:
-            level = log_levels['INFO']
+        if os.path.isfile(path):
+            return os.path.getsize(path)
 
-        # output command results
-        cls.log.info(cls.colorfy(cls.COLOR_RCODE, "RETCODE (%s): %s" %
-                                 (identifier, retcode)))
-        if stdout:
-            cls.log.log(level, cls.colorfy(cls.COLOR_STDOUT,
-                                           "STDOUT (%s)...\n%s" %
-                                           (identifier, stdout)))
+        size = 0
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                filepath = os.path.join(dirpath, filename)
+                if os.path.isfile(filepath):
+                    size += os.path.getsize(filepath)
 
-        if stderr:
-            cls.log.log(level, cls.colorfy(cls.COLOR_STDERR,
-                                           "STDERR (%s)...\n%s" %
-                                           (identifier, stderr)))
+        return size
 
     @classmethod
-    def run_async(cls, host, command, user=None, log_level=None):
-        """Run remote commands asynchronously.
+    def upload_sync(cls, host, localpath, remotepath, user=None,
+                    compare='checksum'):
+        """Uploads a file or directory, skipping files that are unchanged.
+
+        Remote files are compared with the local files in a single command
+        and only the files that differ are sent (in a single tar stream
+        for directories).
 
         Args:
-            host (str): The hostname of the system.
-            command (str): The command to run on the system.
-            user (optional[str]): The user to use for connection.
-            log_level (optional[str]): only log stdout/stderr at this level.
+            host (str): Hostname of the remote system.
+            localpath (str): The source file or directory on the local system.
+            remotepath (str): The target file or directory on the remote
+                server.
+            user (optional[str]): The user to use for the remote connection.
+            compare (optional[str]): 'checksum' compares md5sums.
+                'mtime' compares size and modification time (faster).
 
         Returns:
-            An open connection descriptor to be used by the calling function.
-            None on error.
+            A dictionary report with the lists of 'transferred' and 'skipped'
+            files, 'bytes_transferred', 'bytes_saved', and the 'retcode'
+            of the transfer (zero on success). None on failure.
 
         Example:
-            To run a command asynchronously on remote hosts
-            named "bunkerhill" and "breedshill"...
-
-                >>> from glusto.core import Glusto as g
-
-                >>> command = "ls -R /etc"
-                >>> proc1 = g.run_async("bunkerhill", command)
-                >>> proc2 = g.run_async("breedshill", command)
+            >>> from glusto.core import Glusto as g
+            >>> report = g.upload_sync("bunkerhill", "/root/fixtures",
+            ...                        "/root/fixtures")
+            >>> report['bytes_saved']
+            104857600
+        """
+        if not user:
+            user = cls.user
 
-                >>> results1 = proc1.async_communicate()
-                >>> results2 = proc2.async_communicate()
+        if not os.path.isdir(localpath) and not os.path.isfile(localpath):
+            cls.log.error("upload_sync: %s is not a file or directory" %
+                          localpath)
+            return None
 
-            This can also be used to run a command against the same system
-            asynchronously as different users...
+        ssh = cls._get_ssh_connection(host, user)
+        if not ssh:
+            cls.log.error("ERROR: No ssh connection")
+            return None
+
+        operation = 'upload_sync'
+        start = time.time()
+        is_dir = os.path.isdir(localpath)
+        if not is_dir:
+            # a file uploaded into a directory keeps its name
+            proc = ssh.popen("test -d %s" % pipes.quote(remotepath))
+            proc.communicate()
+            if proc.returncode == 0:
+                remotepath = os.path.join(remotepath,
+                                          os.path.basename(localpath))
+        local_files = cls._sync_local_listing(localpath, compare)
+        if not is_dir:
+            # a single file can be renamed. compare against the remote name.
+            local_files = {os.path.basename(remotepath):
+                           local_files.values()[0]}
+        remote_files = cls._sync_remote_listing(ssh, remotepath, is_dir,
+                                                compare)
+
+        report = cls._sync_compare(local_files, remote_files)
+        cls.log.info("%s@%s: upload_sync %s -> %s (%i changed, %i unchanged)" %
+                     (user, host, localpath, remotepath,
+                      len(report['transferred']), len(report['skipped'])))
+
+        if report['transferred'] and not is_dir:
+            ssh.upload(localpath, remotepath)
+            if compare == 'mtime':
+                mtime = int(os.path.getmtime(localpath))
+                proc = ssh.popen("touch -m -d @%i %s" %
+                                 (mtime, pipes.quote(remotepath)))
+                proc.communicate()
+        elif report['transferred']:
+            # stream the changed files through tar (keeps mtimes)
+            names = "\0".join(report['transferred']) + "\0"
+            local_tar = subprocess.Popen(['tar', '-C', localpath, '-cf', '-',
+                                          '--null', '-T', '-'],
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE)
+            writer = cls._write_in_thread(local_tar.stdin, names)
+            remote_tar = ssh.popen("mkdir -p %s && tar -C %s -xf -" %
+                                   (pipes.quote(remotepath),
+                                    pipes.quote(remotepath)))
+            cls._copy_stream(local_tar.stdout, remote_tar.stdin)
+            remote_tar.stdin.close()
+            writer.join()
+            local_tar.wait()
+            stderr = remote_tar.stderr.read()
+            remote_tar.wait()
+            report['retcode'] = remote_tar.returncode or local_tar.returncode
+            if report['retcode']:
+                cls.log.error("upload_sync to %s failed: %s" % (host, stderr))
+
+        cls._log_sync_report(report)
+        cls.metrics_observe('transfer_bytes', operation, host,
+                            report['bytes_transferred'])
+        cls.metrics_observe('transfer_seconds', operation, host,
+                            time.time() - start)
+
+        return report
 
-                >>> command = "ls -R /etc"
-                >>> proc1 = g.run_async("breedshill", command, user="howe")
-                >>> proc2 = g.run_async("breedshill", command, user="pigot")
+    @classmethod
+    def download_sync(cls, host, remotepath, localpath, user=None,
+                      compare='checksum'):
+        """Downloads a file or directory, skipping files that are unchanged.
 
-                >>> results1 = proc1.async_communicate()
-                >>> results2 = proc2.async_communicate()
+        Args:
+            host (str): Hostname of the remote system.
+            remotepath (str): The source file or directory on the remote
+                server.
+            localpath (str): The target file or directory on the local system.
+            user (optional[str]): The user to use for the remote connection.
+            compare (optional[str]): 'checksum' compares md5sums.
+                'mtime' compares size and modification time (faster).
 
-        Note:
-            run_async() runs commands asynchronously, but blocks on
-            async_communicate() and reads output sequentially.
-            This might not be a good fit for run-and-forget commands."""
+        Returns:
+            A dictionary report with the lists of 'transferred' and 'skipped'
+            files, 'bytes_transferred', 'bytes_saved', and the 'retcode'
+            of the transfer (zero on success). None on failure.
+        """
         if not user:
             user = cls.user
 
-        if cls.use_controlpersist:
-            ctlpersist = " (cp)"
+        ssh = cls._get_ssh_connection(host, user)
+        if not ssh:
+            cls.log.error("ERROR: No ssh connection")
+            return None
+
+        operation = 'download_sync'
+        start = time.time()
+        proc = ssh.popen("test -d %s" % pipes.quote(remotepath))
+        proc.communicate()
+        is_dir = proc.returncode == 0
+        if not is_dir and os.path.isdir(localpath):
+            # a file downloaded into a directory keeps its name
+            localpath = os.path.join(localpath, os.path.basename(remotepath))
+
+        remote_files = cls._sync_remote_listing(ssh, remotepath, is_dir,
+                                                compare)
+        if not is_dir and not remote_files:
+            cls.log.error("download_sync: %s does not exist on %s" %
+                          (remotepath, host))
+            return None
+
+        local_files = {}
+        if os.path.exists(localpath):
+            local_files = cls._sync_local_listing(localpath, compare)
+        if not is_dir:
+            local_files = dict((os.path.basename(remotepath), info)
+                               for info in local_files.values())
+
+        # the remote side is the source, so compare the other way around
+        report = cls._sync_compare(remote_files, local_files)
+        cls.log.info("%s@%s: download_sync %s -> %s "
+                     "(%i changed, %i unchanged)" %
+                     (user, host, remotepath, localpath,
+                      len(report['transferred']), len(report['skipped'])))
+
+        if report['transferred'] and not is_dir:
+            ssh.download(remotepath, localpath)
+            if compare == 'mtime':
+                mtime = remote_files.values()[0][1]
+                os.utime(localpath, (mtime, mtime))
+        elif report['transferred']:
+            if not os.path.isdir(localpath):
+                os.makedirs(localpath)
+            names = "\0".join(report['transferred']) + "\0"
+            remote_tar = ssh.popen("tar -C %s -cf - --null -T -" %
+                                   pipes.quote(remotepath))
+            writer = cls._write_in_thread(remote_tar.stdin, names)
+            local_tar = subprocess.Popen(['tar', '-C', localpath, '-xf', '-'],
+                                         stdin=subprocess.PIPE)
+            cls._copy_stream(remote_tar.stdout, local_tar.stdin)
+            local_tar.stdin.close()
+            writer.join()
+            local_tar.wait()
+            stderr = remote_tar.stderr.read()
+            remote_tar.wait()
+            report['retcode'] = remote_tar.returncode or local_tar.returncode
+            if report['retcode']:
+                cls.log.error("download_sync from %s failed: %s" %
+                              (host, stderr))
+
+        cls._log_sync_report(report)
+        cls.metrics_observe('transfer_bytes', operation, host,
+                            report['bytes_transferred'])
+        cls.metrics_observe('transfer_seconds', operation, host,
+                            time.time() - start)
+
+        return report
+
+    @staticmethod
+    def _sync_local_listing(localpath, compare):
+        """List local files with their size and mtime or md5sum.
 
-            # output command
-            cls.log.info(cls.colorfy(cls.COLOR_COMMAND, "%s@%s%s: %s" %
-                                     (user, host, ctlpersist, command)))
-            # run the command
-            ssh = cls._get_ssh_connection(host, user)
-            if not ssh:
-                print "ERROR: No ssh connection"
-                return None
+        Args:
+            localpath (str): A local file or directory.
+            compare (str): 'checksum' or 'mtime'.
+
+        Returns:
+            A dictionary of (size, mtime or md5sum) tuples labeled by
+            the path relative to localpath (the basename for a file).
+        """
+        if os.path.isdir(localpath):
+            paths = []
+            for dirpath, _, filenames in os.walk(localpath):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    paths.append((os.path.relpath(path, localpath), path))
+        else:
+            paths = [(os.path.basename(localpath), localpath)]
+
+        files = {}
+        for name, path in paths:
+            if not os.path.isfile(path):
+                continue
+            size = os.path.getsize(path)
+            if compare == 'mtime':
+                files[name] = (size, int(os.path.getmtime(path)))
+            else:
+                md5 = hashlib.md5()
+                with open(path, 'rb') as fd:
+                    for chunk in iter(lambda: fd.read(1048576), ''):
+                        md5.update(chunk)
+                files[name] = (size, md5.hexdigest())
+
+        return files
+
+    @staticmethod
+    def _sync_remote_listing(ssh, remotepath, is_dir, compare):
+        """List remote files with their size and mtime or md5sum.
 
-            p = ssh.popen(command)
+        Args:
+            ssh (obj): An ssh connection.
+            remotepath (str): A remote file or directory.
+            is_dir (bool): True if remotepath is a directory.
+            compare (str): 'checksum' or 'mtime'.
 
-        def async_communicate():
-            stdout, stderr = p.communicate()
-            retcode = p.returncode
+        Returns:
+            A dictionary of (size, mtime or md5sum) tuples labeled by
+            the path relative to remotepath (the basename for a file).
+            Empty if remotepath does not exist.
+        """
+        if is_dir:
+            root = remotepath
+            find = "find . -type f"
+        else:
+            root = os.path.dirname(remotepath) or '.'
+            find = "find %s -maxdepth 0 -type f" % \
+                pipes.quote(os.path.basename(remotepath))
 
-            # output command results
-            identifier = "%s@%s" % (user, host)
-            cls._log_results(identifier, retcode, stdout, stderr,
-                             log_level=log_level)
+        # NUL-separated, so any file name survives
+        if compare == 'mtime':
+            command = "%s -printf '%%s %%T@ %%p\\0'" % find
+        else:
+            # the sizes, then the md5sums after a blank line
+            command = ("%s -printf '%%s %%p\\0'; echo; "
+                       "%s -exec md5sum {} +" % (find, find))
+
+        proc = ssh.popen("cd %s 2>/dev/null && %s" %
+                         (pipes.quote(root), command))
+        stdout, _ = proc.communicate()
+
+        # (each record starts with the size, so only the blank line
+        # follows a NUL with a newline)
+        listing, _, checksums = ('\0' + stdout).partition('\0\n')
+
+        files = {}
+        for record in listing.split('\0'):
+            if not record:
+                continue
+            if compare == 'mtime':
+                size, mtime, name = record.split(' ', 2)
+                files[os.path.normpath(name)] = (int(size),
+                                                 int(float(mtime)))
+            else:
+                size, name = record.split(' ', 1)
+                files[os.path.normpath(name)] = (int(size), None)
+
+        for line in checksums.splitlines():
+            # md5sum escapes names with a backslash or newline and
+            # starts the line with a backslash
+            md5_match = re.match(r'^(\\?)([0-9a-f]{32})  (.*)$', line)
+            if not md5_match:
+                continue
+            name = md5_match.group(3)
+            if md5_match.group(1):
+                name = re.sub(r'\\(.)', lambda match:
+                              {'n': '\n', 'r': '\r'}.get(match.group(1),
+                                                          match.group(1)),
+                              name)
+            name = os.path.normpath(name)
+            if name in files:
+                files[name] = (files[name][0], md5_match.group(2))
+
+        return files
+
+    @staticmethod
+    def _sync_compare(source_files, target_files):
+        """Compare source and target listings to build a sync report.
 
-            return (retcode, stdout, stderr)
+        Args:
+            source_files (dict): The listing of the files being copied.
+            target_files (dict): The listing of the files at the target.
 
-        p.async_communicate = async_communicate
-        return p
+        Returns:
+            A dictionary report (see upload_sync).
+        """
+        report = {'transferred': [], 'skipped': [],
+                  'bytes_transferred': 0, 'bytes_saved': 0, 'retcode': 0}
+        for name in sorted(source_files):
+            size = source_files[name][0]
+            if target_files.get(name) == source_files[name]:
+                report['skipped'].append(name)
+                report['bytes_saved'] += size
+            else:
+                report['transferred'].append(name)
+                report['bytes_transferred'] += size
+
+        return report
 
     @classmethod
-    def run_local(cls, command, log_level=None):
-        """Run a command on the local management system.
+    def _log_sync_report(cls, report):
+        """Log the summary of a sync report."""
+        cls.log.info("sync: %i files (%i bytes) transferred, "
+                     "%i files (%i bytes) skipped, retcode %i" %
+                     (len(report['transferred']), report['bytes_transferred'],
+                      len(report['skipped']), report['bytes_saved'],
+                      report['retcode']))
+
+    @staticmethod
+    def _write_in_thread(target, data):
+        """Write data to a pipe (and close it) from a new thread.
+
+        For feeding a command's stdin while its stdout is being read,
+        so a full pipe can not block both sides.
 
         Args:
-            command (str): Command to run locally.
-            log_level (optional[str]): only log stdout/stderr at this level.
+            target (file): A writable file object.
+            data (str): The data to write.
 
         Returns:
-            A tuple consisting of the command return code, stdout, and stderr.
+            The started thread.
+        """
+        def write():
+            try:
+                target.write(data)
+                target.close()
+            except (IOError, OSError):
+                # the command exited early. its retcode tells why.
+                pass
 
-        Example:
-            To run a command locally...
+        thread = threading.Thread(target=write)
+        thread.daemon = True
+        thread.start()
 
-                >>> from glusto.core import Glusto as g
-                >>> retcode, stdout, stderr = g.run_local("uname -a")
-        """
-        # output command
-        cls.log.info("local: %s" % command)
+        return thread
 
-        p = subprocess.Popen(command, shell=True,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE)
-        stdout, stderr = p.communicate()
-        retcode = p.returncode
+    @staticmethod
+    def _copy_stream(source, target, chunk_size=65536):
+        """Copy a stream in fixed-size chunks.
 
-        # output command results
-        cls._log_results('local', retcode, stdout, stderr,
-                         log_level=log_level)
+        Args:
+            source (file): A readable file object.
+            target (file): A writable file object.
+            chunk_size (optional[int]): The size of each read.
 
-        return (retcode, stdout, stderr)
+        Returns:
+            The number of bytes copied.
+        """
+        copied = 0
+        while True:
+            chunk = os.read(source.fileno(), chunk_size)
+            if not chunk:
+                break
+            target.write(chunk)
+            copied += len(chunk)
+
+        return copied
+
+    # tar options for each compression on the wire
+    _stream_compressions = {
+        'gzip': (['-z'], '.tar.gz'),
+        'zstd': (['--use-compress-program=zstd'], '.tar.zst'),
+        None: ([], '.tar'),
+    }
 
     @classmethod
-    def run_serial(cls, hosts, command, user=None, log_level=None):
-        """Sequentially runs a command against a list of hosts.
+    def download_stream(cls, host, remotepath, localpath, user=None,
+                        compression='gzip', extract=True, chunk_size=1048576):
+        """Downloads a file or directory as a compressed tar stream.
+
+        The remote tar output is read in fixed-size chunks and written
+        straight to disk, so memory use does not grow with the size
+        of the download.
 
         Args:
-            hosts (list): A list of hostnames to run command against.
-            command (str): The command to run on the system.
-            user (optional[str]): The user to use for connection.
-            log_level (optional[str]): only log stdout/stderr at this level.
+            host (str): Hostname of the remote system.
+            remotepath (str): The source file or directory on the remote
+                server.
+            localpath (str): The local directory to download into.
+            user (optional[str]): The user to use for the remote connection.
+            compression (optional[str]): 'gzip', 'zstd', or None.
+                zstd must be installed on both systems.
+            extract (optional[bool]): Extract into localpath (default).
+                If False, the archive is saved in localpath as is.
+            chunk_size (optional[int]): The size of each read from the stream.
 
         Returns:
-            A dictionary of tuples containing returncode, stdout, and stderr.
-            Labeled by the host.
+            A dictionary report with the 'bytes' received over the wire,
+            the 'seconds' taken, the 'path' of the extracted directory or
+            saved archive, and the 'retcode' (zero on success).
+            None on failure.
 
         Example:
-            To run a command against a list of hosts...
-
-                >>> from glusto.core import Glusto as g
-                >>> hosts = ["bunkerhill", "breedshill"]
-                >>> results = g.run_serial(hosts, "ls -Rail /etc")
+            >>> from glusto.core import Glusto as g
+            >>> report = g.download_stream("bunkerhill", "/var/log/glusterfs",
+            ...                            "/tmp/logs")
+            >>> report['path']
+            '/tmp/logs/glusterfs'
         """
-        results = {}
-        for host in hosts:
-            rcode, rout, rerr = cls.run(host, command, user=user,
-                                        log_level=log_level)
+        if not user:
+            user = cls.user
 
-            results[host] = (rcode, rout, rerr)
+        if compression not in cls._stream_compressions:
+            cls.log.error("Unknown compression: %s" % compression)
+            return None
 
-        return results
+        ssh = cls._get_ssh_connection(host, user)
+        if not ssh:
+            cls.log.error("ERROR: No ssh connection")
+            return None
+
+        if not os.path.isdir(localpath):
+            os.makedirs(localpath)
+
+        remotepath = remotepath.rstrip('/') or '/'
+        name = os.path.basename(remotepath)
+        tar_options, suffix = cls._stream_compressions[compression]
+        command = "tar -C %s -c %s -f - %s" % \
+            (pipes.quote(os.path.dirname(remotepath) or '.'),
+             " ".join(tar_options), pipes.quote(name))
+
+        if extract:
+            path = os.path.join(localpath, name)
+            target_proc = subprocess.Popen(['tar', '-C', localpath, '-x'] +
+                                           tar_options + ['-f', '-'],
+                                           stdin=subprocess.PIPE)
+            target = target_proc.stdin
+        else:
+            path = os.path.join(localpath, name + suffix)
+            target_proc = None
+            target = open(path, 'wb')
+
+        cls.log.info("%s@%s: download_stream %s -> %s" %
+                     (user, host, remotepath, path))
+        start = time.time()
+        proc = ssh.popen(command)
+        proc.stdin.close()
+
+        # read stdout and stderr together so neither pipe can fill and stall
+        poller = _OutputPoller(chunk_size)
+        poller.add(host, proc)
+        report = {'bytes': 0, 'seconds': 0, 'path': path, 'retcode': None}
+        stderr = []
+        try:
+            while poller:
+                for _, stream, data in poller.poll():
+                    if stream == 'stdout':
+                        target.write(data)
+                        report['bytes'] += len(data)
+                    elif stream == 'stderr':
+                        stderr.append(data)
+                    else:
+                        report['retcode'] = data
+        except (IOError, OSError) as err:
+            # e.g., the local tar exited early
+            cls.log.error("download_stream from %s failed: %s" % (host, err))
+            cls._kill_proc(poller.remove(host))
+            proc.wait()
+            report['retcode'] = proc.returncode or 1
+        finally:
+            target.close()
+            if target_proc:
+                target_proc.wait()
+
+        report['seconds'] = time.time() - start
+        if not report['retcode'] and target_proc:
+            report['retcode'] = target_proc.returncode
+        if report['retcode']:
+            cls.log.error("download_stream from %s failed (%s): %s" %
+                          (host, report['retcode'], "".join(stderr)))
+
+        cls._log_stream_report(host, report)
+        cls.metrics_observe('transfer_bytes', 'download_stream', host,
+                            report['bytes'])
+        cls.metrics_observe('transfer_seconds', 'download_stream', host,
+                            report['seconds'])
+
+        return report
 
     @classmethod
-    def run_parallel(cls, hosts, command, user=None, log_level=None):
-        """Runs a command against a list of hosts in parallel.
+    def download_stream_many(cls, hosts, remotepath, localpath, user=None,
+                             compression='gzip', extract=True,
+                             max_workers=None):
+        """Downloads a file or directory from many systems in parallel.
+
+        Each host is downloaded into its own directory under localpath
+        (e.g., localpath/hostname/glusterfs) with download_stream().
 
         Args:
-            hosts (list): A list of hostnames to run command against.
-            command (str): The command to run on the system.
-            user (optional[str]): The user to use for connection.
-            log_level (optional[str]): only log stdout/stderr at this level.
+            hosts (list): A list of hostnames to download from.
+            remotepath (str): The source file or directory on the remote
+                servers.
+            localpath (str): The local directory for the host directories.
+            user (optional[str]): The user to use for the remote connection.
+            compression (optional[str]): 'gzip', 'zstd', or None.
+            extract (optional[bool]): Extract into the host directories.
+            max_workers (optional[int]): The maximum number of transfers
+                at the same time.
 
         Returns:
-            A dictionary of tuples containing returncode, stdout, and stderr.
-            Labeled by the host.
+            A dictionary of download_stream() reports labeled by the host.
+            A report is None if the download could not be started.
 
         Example:
-            To run a command against a list of hosts in parallel...
-
-                >>> from glusto.core import Glusto as g
-                >>> hosts = ["bunkerhill", "breedshill"]
-                >>> results = g.run_serial(hosts, "ls -Rail /etc")
+            >>> from glusto.core import Glusto as g
+            >>> reports = g.download_stream_many(g.config['nodes'],
+            ...                                  '/var/log/glusterfs',
+            ...                                  '/tmp/logs')
         """
-        '''
-        results = {}
-        for host in hosts:
-            rcode, rout, rerr = cls.run(host, command, user)
+        def download(host):
+            try:
+                return cls.download_stream(host, remotepath,
+                                           os.path.join(localpath, host),
+                                           user=user, compression=compression,
+                                           extract=extract)
+            except Exception as err:
+                cls.log.error("download_stream from %s failed: %s" %
+                              (host, err))
+                return None
 
-            results[host] = (rcode, rout, rerr)
+        start = time.time()
+        reports = {}
+        for host, report in cls._parallel_map(
+                download, hosts, max_workers=max_workers,
+                operation='download_stream_many'):
+            reports[host] = report
 
-        return results
-        '''
-        results = {}
-        rasyncs = {}
-        # run the commands async and record the returned communicate object
-        for host in hosts:
-            rasyncs[host] = cls.run_async(host, command, user, log_level)
+        total = sum(report['bytes'] for report in reports.values() if report)
+        cls._log_stream_report("%i hosts" % len(reports),
+                               {'bytes': total,
+                                'seconds': time.time() - start})
 
-        # loop through communicate() calls and record results
-        for host, proc in rasyncs.items():
-            results[host] = proc.async_communicate()
+        failed = [host for host, report in reports.items()
+                  if not report or report['retcode']]
+        if failed:
+            cls.log.error("download_stream of %s failed on: %s" %
+                          (remotepath, ", ".join(sorted(failed))))
 
-        return results
+        return reports
 
     @classmethod
-    def upload(cls, host, localpath, remotepath, user=None):
-        """Uploads a file to a remote system.
+    def _log_stream_report(cls, name, report):
+        """Log the bytes and throughput of a streamed transfer."""
+        seconds = report['seconds']
+        rate = report['bytes'] / seconds / 1048576 if seconds else 0
+        cls.log.info("%s: streamed %i bytes in %.2f seconds (%.2f MiB/s)" %
+                     (name, report['bytes'], seconds, rate))
+
+    @classmethod
+    def transfer(cls, sourcehost, sourcefile,
+                 targethost, targetfile, user=None, scp_opts=None):
+        """Transfer a file between remote systems (scp)
+        Requires keys to be set up between remote systems.
 
         Args:
-            host (str): Hostname of the remote system.
-            localpath (str): The source path for the file on the local system.
-            remotepath (str): The target path on the remote server.
+            sourcehost (str): Hostname of the remote system copying from.
+            sourcefile (str): The source path on a remote system.
+            targethost (str): Hostname of the remote system copying to.
+            targetfile (str): The target path for the file on a remote system.
             user (optional[str]): The user to use for the remote connection.
+            scp_opts (optional[str]): Options for the scp command
+                (e.g., '-oBatchMode=yes').
 
         Returns:
-            None on failure.
+            A tuple consisting of the scp return code, stdout, and stderr.
         """
-        # TODO: consider a noclobber option to backup existing files
 
         if not user:
             user = cls.user
 
-        # run the command
-        ssh = cls._get_ssh_connection(host, user)
-        if not ssh:
-            print "ERROR: No ssh connection"
-            return False
-
-        # TODO: catch exceptions thrown by SshMachine.upload()
-        ssh.upload(localpath, remotepath)
+        # TODO: add keyfile option
+        command = 'scp %s%s %s@%s:%s' % ('%s ' % scp_opts if scp_opts else '',
+                                         sourcefile,
+                                         user, targethost, targetfile)
+        return cls.run(sourcehost, command)
 
     @classmethod
-    def download(cls, host, remotepath, localpath, user=None):
-        """Downloads a file from a remote system.
+    def upload_many(cls, hosts, localpath, remotepath, user=None,
+                    max_workers=None, relay=False):
+        """Uploads a file to many remote systems in parallel.
 
         Args:
-            host (str): Hostname of the remote system.
-            remotepath (str): The source path on the remote server.
-            localpath (str): The target path for the file on the local system.
+            hosts (list): A list of hostnames to upload the file to.
+            localpath (str): The source path for the file on the local system.
+            remotepath (str): The target path on the remote servers.
             user (optional[str]): The user to use for the remote connection.
+            max_workers (optional[int]): The maximum number of transfers
+                at the same time.
+            relay (optional[bool]): Upload to the first host only, then have
+                hosts that already have the file copy it to the others with
+                transfer(). The number of copies doubles with each round,
+                so the local system's bandwidth is not the bottleneck.
+                Requires keys to be set up between the remote systems.
+                Hosts that fail a relay copy are retried with an upload.
 
         Returns:
-            None on failure.
+            A dictionary of True (success) or False (failure) values.
+            Labeled by the host.
+
+        Example:
+            >>> from glusto.core import Glusto as g
+            >>> results = g.upload_many(g.config['nodes'],
+            ...                         '/tmp/image.qcow2', '/tmp/image.qcow2',
+            ...                         relay=True)
         """
-        # TODO: consider a noclobber option to backup existing files
+        def upload(host):
+            try:
+                return cls.upload(host, localpath, remotepath,
+                                  user=user) is not False
+            except Exception as err:
+                cls.log.error("Upload to %s failed: %s" % (host, err))
+                return False
+
+        def relay_copy(hosts_pair):
+            source, target = hosts_pair
+            # never prompt for a password or host key on the relay host
+            retcode, _, _ = cls.transfer(source, remotepath,
+                                         target, remotepath, user=user,
+                                         scp_opts=cls.relay_scp_opts)
+            return retcode == 0
+
+        hosts = list(hosts)
+        results = {}
+        if relay and hosts:
+            # seed the first host from the local system
+            results[hosts[0]] = upload(hosts[0])
+            seeds = [host for host in hosts[:1] if results[host]]
+            remaining = deque(hosts[1:])
+
+            # each host that has the file copies it to one more host a round
+            while seeds and remaining:
+                pairs = [(seed, remaining.popleft()) for seed in seeds
+                         if remaining]
+                for (_, target), copied in cls._parallel_map(
+                        relay_copy, pairs, max_workers=max_workers,
+                        operation='upload_many_relay',
+                        host_of=lambda hosts_pair: hosts_pair[1]):
+                    results[target] = copied
+                    if copied:
+                        seeds.append(target)
+
+            # fall back to uploading from the local system
+            retry = list(remaining)
+            retry.extend(host for host in hosts if not results.get(host, True))
+            if retry:
+                cls.log.warning("upload_many relay did not reach %s. "
+                                "Uploading from the local system." %
+                                ", ".join(retry))
+        else:
+            retry = hosts
 
-        if not user:
-            user = cls.user
+        for host, uploaded in cls._parallel_map(upload, retry,
+                                                max_workers=max_workers,
+                                                operation='upload_many'):
+            results[host] = uploaded
 
-        # run the command
-        ssh = cls._get_ssh_connection(host, user)
-        if not ssh:
-            print "ERROR: No ssh connection"
-            return False
+        failed = [host for host in hosts if not results[host]]
+        if failed:
+            cls.log.error("Upload of %s failed on: %s" %
+                          (localpath, ", ".join(failed)))
 
-        # TODO: catch exceptions thrown by SshMachine.download()
-        ssh.download(remotepath, localpath)
+        return results
 
     @classmethod
-    def transfer(cls, sourcehost, sourcefile,
-                 targethost, targetfile, user=None):
-        """Transfer a file between remote systems (scp)
-        Requires keys to be set up between remote systems.
+    def ssh_connect_all(cls, hosts=None, user=None, max_workers=None):
+        """Open and validate ssh connections to many hosts in parallel.
+
+        Use before the first test to pay the ssh handshake and ControlMaster
+        setup cost up front instead of serially inside the tests.
 
         Args:
-            sourcehost (str): Hostname of the remote system copying from.
-            sourcefile (str): The source path on a remote system.
-            targethost (str): Hostname of the remote system copying to.
-            targetfile (str): The target path for the file on a remote system.
-            user (optional[str]): The user to use for the remote connection.
+            hosts (optional[list]): A list of hostnames to connect to.
+                Defaults to the nodes, servers, and clients in the config.
+            user (optional[str]): The user to use for connection.
+            max_workers (optional[int]): The maximum number of hosts
+                to connect to at the same time.
 
         Returns:
-            Nothing
+            A dictionary of True (connected) or False (failed) values.
+            Labeled by the host.
+
+        Example:
+            >>> from glusto.core import Glusto as g
+            >>> results = g.ssh_connect_all()
+            >>> failed = [host for host, ok in results.items() if not ok]
         """
+        if hosts is None:
+            hosts = []
+            for key in ('nodes', 'servers', 'clients'):
+                for host in cls.config.get(key) or []:
+                    if host not in hosts:
+                        hosts.append(host)
+
+        def connect(host):
+            ssh = cls._get_ssh_connection(host, user)
+            if not ssh:
+                return False
+            try:
+                proc = ssh.popen('true')
+                proc.communicate()
+            except Exception as err:
+                cls.log.error("Validating connection to %s failed: %s" %
+                              (host, err))
+                return False
 
-        if not user:
-            user = cls.user
+            return proc.returncode == 0
+
+        cls.log.info("Connecting to %i hosts" % len(hosts))
+        results = {}
+        for host, connected in cls._parallel_map(connect, hosts,
+                                                 max_workers=max_workers,
+                                                 operation='ssh_connect_all'):
+            results[host] = connected
+
+        failed = [host for host in hosts if not results[host]]
+        if failed:
+            cls.log.error("Failed to connect to: %s" % ", ".join(failed))
 
-        # TODO: add scp options (keyfile, etc)
-        command = 'scp %s %s@%s:%s' % (sourcefile,
-                                       user, targethost, targetfile)
-        cls.run(sourcehost, command)
+        return results
 
     @classmethod
     def ssh_list_connections(cls):
@@ -448,16 +3414,26 @@ class Connectible(object):
 
     @classmethod
     def ssh_get_connections(cls):
-        """Retrieves the dictionary of ssh connections.
+        """Retrieves the pool of ssh connections.
 
         Returns:
-            A dictionary of ssh connections.
+            The pool of ssh connections. Provides dictionary access to the
+            connections labeled by user@host, and a stats attribute
+            with hits, misses, reconnects, and evictions counters.
+
+        Example:
+            >>> from glusto.core import Glusto as g
+            >>> connections = g.ssh_get_connections()
+            >>> connections.keys()
+            ['root@bunkerhill', 'root@breedshill']
+            >>> connections.stats
+            {'hits': 42, 'misses': 2, 'reconnects': 0, 'evictions': 0}
         """
         return cls._ssh_connections
 
     @classmethod
     def ssh_close_connection(cls, host, user=None):
-        """Close an SshMachine connection.
+        """Close an SshMachine connection (all channels and backends).
 
         Args:
             host (str): Hostname of the system.
@@ -469,10 +3445,14 @@ class Connectible(object):
         if not user:
             user = cls.user
 
+        # close the connection for every channel to the host
         conn_name = "%s@%s" % (user, host)
-        connection = cls._get_ssh_connection(host, user)
-        del cls._ssh_connections[conn_name]
-        connection.close()
+        for key in cls._ssh_connections.keys():
+            # strip the channel and backend from the connection name
+            if key.split(' ')[0].split('#')[0] == conn_name:
+                connection = cls._ssh_connections.remove(key)
+                if connection:
+                    connection.close()
 
     @classmethod
     def ssh_close_connections(cls):
@@ -486,9 +3466,9 @@ class Connectible(object):
         """
         for key in cls._ssh_connections.keys():
             print "closing ssh connection %s" % key
-            connection = cls._ssh_connections[key]
-            del cls._ssh_connections[key]
-            connection.close()
+            connection = cls._ssh_connections.remove(key)
+            if connection:
+                connection.close()
 
     @classmethod
     def ssh_set_keyfile(cls, keyfile):
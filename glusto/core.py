@@ -31,6 +31,7 @@ from glusto.configurable import Configurable
 from glusto.connectible import Connectible
 from glusto.colorfiable import Colorfiable
 from glusto.loggable import Loggable
+from glusto.measurable import Measurable
 from glusto.templatable import Templatable
 from glusto.unittestable import Unittestable
 from glusto.restable import Restable
@@ -39,7 +40,8 @@ from glusto.carteplex import Carteplex
 
 
 class Glusto(Configurable, Connectible, Colorfiable, Loggable,
-             Templatable, Unittestable, Restable, Rpycable, Carteplex):
+             Templatable, Unittestable, Restable, Rpycable, Carteplex,
+             Measurable):
     """The locker for all things Glusto."""
 
     # TODO: figure out how we want to do this with cli options
@@ -125,6 +125,18 @@ def main():
 
     g.show_config(g.config)
 
+    # open ssh connections to all hosts up front (True or a list of hosts)
+    ssh_connect_all = g.config.get('ssh_connect_all', False)
+    if ssh_connect_all:
+        hosts = None
+        if isinstance(ssh_connect_all, list):
+            hosts = ssh_connect_all
+        results = g.ssh_connect_all(hosts)
+        failed = [host for host, connected in results.items()
+                  if not connected]
+        if failed:
+            print "Failed ssh connections: %s" % ", ".join(failed)
+
     # unittest
     # TODO: functionalize this so it can be used for standalone test scripts
     if args.run_unittest_config or args.discover_dir:
@@ -251,6 +263,14 @@ def main():
         if num_errors > 0 or num_failures > 0:
             retcode = retcode | UNITTEST_FAIL
 
+    # export metrics for the run
+    metrics_json = g.config.get('metrics_json')
+    if metrics_json:
+        g.metrics_dump_json(metrics_json)
+    metrics_prometheus = g.config.get('metrics_prometheus')
+    if metrics_prometheus:
+        g.metrics_dump_prometheus(metrics_prometheus)
+
     g.log.info("Ending glusto via main()")
     print "Ending glusto via main()"
 
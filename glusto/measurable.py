@@ -0,0 +1,226 @@
+# Copyright 2016 Jonathan Holloway <loadtheaccumulator@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""All things metrics.
+
+Histograms of latency and throughput are kept for each metric,
+operation, and host. Connectible and Rpycable record:
+
+- connect_seconds: Time to open an ssh or rpyc connection.
+- command_seconds: Wall time of remote (and local) commands.
+- transfer_seconds: Wall time of file transfers.
+- transfer_bytes: Bytes sent or received by file transfers.
+- queue_wait_seconds: Time an operation waited for a free worker.
+
+NOTE:
+    Measurable is inherited by the Glusto class
+    and not designed to be instantiated.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class _Histogram(object):
+    """Counts observations into cumulative buckets (Prometheus style)."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        """Add an observation."""
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def to_dict(self):
+        """Return the histogram as a dictionary."""
+        return {'count': self.count,
+                'sum': self.sum,
+                'min': self.min,
+                'max': self.max,
+                'mean': self.sum / float(self.count) if self.count else None,
+                'buckets': [[bound, count] for bound, count in
+                            zip(self.buckets, self.counts)]}
+
+
+class Measurable(object):
+    """Collects and exports metrics for remote operations."""
+
+    SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                       1, 2.5, 5, 10, 30, 60, 300, 900)
+    """Histogram bucket bounds for metrics in seconds"""
+    BYTES_BUCKETS = (1024, 16384, 65536, 262144, 1048576, 4194304,
+                     16777216, 67108864, 268435456, 1073741824)
+    """Histogram bucket bounds for metrics in bytes"""
+
+    _metrics = {}
+    _metrics_lock = threading.Lock()
+
+    @classmethod
+    def metrics_observe(cls, metric, operation, host, value):
+        """Record a value in the histogram for a metric.
+
+        Args:
+            metric (str): The name of the metric (e.g., 'command_seconds').
+                Names ending in '_bytes' use byte-sized buckets.
+            operation (str): The operation measured (e.g., 'run').
+            host (str): The host the operation was run against.
+            value (float): The value to record.
+
+        Returns:
+            Nothing
+        """
+        if not cls.config.get('metrics', True):
+            return
+
+        key = (metric, operation, host)
+        with cls._metrics_lock:
+            histogram = cls._metrics.get(key)
+            if histogram is None:
+                buckets = cls.SECONDS_BUCKETS
+                if metric.endswith('_bytes'):
+                    buckets = cls.BYTES_BUCKETS
+                histogram = cls._metrics[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    @classmethod
+    @contextmanager
+    def metrics_timer(cls, metric, operation, host):
+        """Time a block of code and record the seconds taken.
+
+        Args:
+            metric (str): The name of the metric (e.g., 'command_seconds').
+            operation (str): The operation measured.
+            host (str): The host the operation was run against.
+
+        Example:
+            >>> with g.metrics_timer('command_seconds', 'heal', 'bunkerhill'):
+            ...     wait_for_heal()
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            cls.metrics_observe(metric, operation, host, time.time() - start)
+
+    @classmethod
+    def metrics_get(cls):
+        """Get a snapshot of all metrics.
+
+        Args:
+            None
+
+        Returns:
+            A dictionary of histograms (count, sum, min, max, mean, and
+            cumulative buckets) labeled by metric, operation, and host.
+
+        Example:
+            >>> metrics = g.metrics_get()
+            >>> metrics['command_seconds']['run']['bunkerhill']['mean']
+            0.0362
+        """
+        metrics = {}
+        with cls._metrics_lock:
+            for (metric, operation, host), histogram in cls._metrics.items():
+                operations = metrics.setdefault(metric, {})
+                operations.setdefault(operation, {})[host] = \
+                    histogram.to_dict()
+
+        return metrics
+
+    @classmethod
+    def metrics_reset(cls):
+        """Clear all metrics.
+
+        Args:
+            None
+
+        Returns:
+            Nothing
+        """
+        with cls._metrics_lock:
+            cls._metrics.clear()
+
+    @classmethod
+    def metrics_dump_json(cls, filename):
+        """Write all metrics to a JSON file.
+
+        Args:
+            filename (str): The path of the file to write.
+
+        Returns:
+            Nothing
+        """
+        with open(filename, 'w') as fd:
+            json.dump(cls.metrics_get(), fd, indent=2, sort_keys=True)
+        cls.log.info("Wrote metrics to %s", filename)
+
+    @classmethod
+    def metrics_dump_prometheus(cls, filename, prefix='glusto'):
+        """Write all metrics to a file in the Prometheus text format.
+
+        The file can be picked up by the node_exporter textfile collector
+        or pushed to a Pushgateway.
+
+        Args:
+            filename (str): The path of the file to write.
+            prefix (optional[str]): The prefix for the metric names.
+
+        Returns:
+            Nothing
+        """
+        with cls._metrics_lock:
+            histograms = sorted(cls._metrics.items())
+
+        lines = []
+        last_metric = None
+        for (metric, operation, host), histogram in histograms:
+            name = "%s_%s" % (prefix, metric)
+            if metric != last_metric:
+                lines.append("# TYPE %s histogram" % name)
+                last_metric = metric
+
+            labels = 'operation="%s",host="%s"' % \
+                (cls._prometheus_escape(operation),
+                 cls._prometheus_escape(host))
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append('%s_bucket{%s,le="%s"} %i' %
+                             (name, labels, repr(float(bound)), count))
+            lines.append('%s_bucket{%s,le="+Inf"} %i' %
+                         (name, labels, histogram.count))
+            lines.append('%s_sum{%s} %s' %
+                         (name, labels, repr(float(histogram.sum))))
+            lines.append('%s_count{%s} %i' % (name, labels, histogram.count))
+
+        with open(filename, 'w') as fd:
+            fd.write("\n".join(lines) + "\n")
+        cls.log.info("Wrote Prometheus metrics to %s", filename)
+
+    @staticmethod
+    def _prometheus_escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"')
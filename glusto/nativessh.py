@@ -0,0 +1,304 @@
+# Copyright 2016 Jonathan Holloway <loadtheaccumulator@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Native (in-process) SSH transport using paramiko.
+
+Provides the subset of the plumbum SshMachine interface used by Connectible
+(popen, upload, download, close) over a single persistent SSH transport.
+Each command runs on a new channel of that transport,
+so no ssh client process is forked per command.
+
+NOTE:
+    Selected with ``ssh_backend: native`` in the config.
+    Requires paramiko (pip install paramiko).
+"""
+import errno
+import os
+import pipes
+import select
+import socket
+import stat
+import threading
+
+import paramiko
+
+
+class NativeSshMachine(object):
+    """An in-process ssh connection with the SshMachine methods
+    used by Connectible."""
+
+    def __init__(self, host, user, keyfile=None, port=22, connect_timeout=10,
+                 keepalive=30):
+        """Connect to a remote system.
+
+        Args:
+            host (str): Hostname of the system.
+            user (str): User to use for connection.
+            keyfile (optional[str]): Private key file.
+                Defaults to the ssh agent and ~/.ssh keys.
+            port (optional[int]): The ssh port.
+            connect_timeout (optional[int]): Seconds to wait on connect.
+            keepalive (optional[int]): Seconds between keepalive packets.
+        """
+        self.host = host
+        self.user = user
+        self._client = paramiko.SSHClient()
+        self._client.load_system_host_keys()
+        self._client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self._client.connect(host, port=port, username=user,
+                             key_filename=keyfile, timeout=connect_timeout,
+                             allow_agent=True, look_for_keys=True)
+        self._transport = self._client.get_transport()
+        self._transport.set_keepalive(keepalive)
+
+    def __repr__(self):
+        return "NativeSshMachine(%s@%s)" % (self.user, self.host)
+
+    def alive(self):
+        """Check the transport is still connected."""
+        return bool(self._transport and self._transport.is_active())
+
+    def popen(self, args):
+        """Run a command on a new channel.
+
+        Args:
+            args (str|list): The command string or a list of arguments.
+
+        Returns:
+            A NativePopen object.
+        """
+        if not isinstance(args, basestring):
+            args = " ".join(pipes.quote(str(arg)) for arg in args)
+
+        channel = self._transport.open_session()
+        channel.exec_command(args)
+
+        return NativePopen(channel)
+
+    def upload(self, src, dst):
+        """Upload a file or directory (recursively) via sftp.
+
+        Args:
+            src (str): The local path.
+            dst (str): The remote path.
+        """
+        sftp = self._client.open_sftp()
+        try:
+            self._upload(sftp, src, dst)
+        finally:
+            sftp.close()
+
+    def _upload(self, sftp, src, dst):
+        if os.path.isdir(src):
+            try:
+                if stat.S_ISDIR(sftp.stat(dst).st_mode):
+                    dst = '%s/%s' % (dst, os.path.basename(src))
+            except IOError:
+                pass
+            try:
+                sftp.mkdir(dst)
+            except IOError:
+                pass
+            for name in os.listdir(src):
+                self._upload(sftp, os.path.join(src, name),
+                             '%s/%s' % (dst, name))
+        else:
+            sftp.put(src, dst)
+
+    def download(self, src, dst):
+        """Download a file or directory (recursively) via sftp.
+
+        Args:
+            src (str): The remote path.
+            dst (str): The local path.
+        """
+        sftp = self._client.open_sftp()
+        try:
+            self._download(sftp, src, dst)
+        finally:
+            sftp.close()
+
+    def _download(self, sftp, src, dst):
+        if stat.S_ISDIR(sftp.stat(src).st_mode):
+            if os.path.isdir(dst):
+                dst = os.path.join(dst, os.path.basename(src))
+            if not os.path.exists(dst):
+                os.makedirs(dst)
+            for name in sftp.listdir(src):
+                self._download(sftp, '%s/%s' % (src, name),
+                               os.path.join(dst, name))
+        else:
+            sftp.get(src, dst)
+
+    def close(self):
+        """Close the connection."""
+        self._client.close()
+
+
+class NativePopen(object):
+    """A subprocess.Popen-like object for a command running on a channel.
+
+    stdout and stderr are OS pipes fed from the channel by a pump thread,
+    so they can be read with communicate() or polled with select/poll
+    like the pipes of a local process.
+    """
+
+    def __init__(self, channel, chunk_size=65536):
+        self.pid = None
+        self.returncode = None
+        self.chunk_size = chunk_size
+        self._channel = channel
+        self._killed = False
+
+        self.stdin = _ChannelStdin(channel)
+        out_read, self._out_write = os.pipe()
+        err_read, self._err_write = os.pipe()
+        self.stdout = os.fdopen(out_read, 'rb', 0)
+        self.stderr = os.fdopen(err_read, 'rb', 0)
+
+        self._pump_thread = threading.Thread(target=self._pump)
+        self._pump_thread.daemon = True
+        self._pump_thread.start()
+
+    def _pump(self):
+        """Copy channel output to the stdout and stderr pipes.
+
+        Reads until the end of both streams. The exit status can arrive
+        before the last of the output.
+        """
+        channel = self._channel
+        # select() on the channel only wakes up for stdout. have both
+        # streams set one event instead.
+        ready = threading.Event()
+        channel.in_buffer.set_event(ready)
+        channel.in_stderr_buffer.set_event(ready)
+        try:
+            while True:
+                ready.clear()
+                if channel.recv_ready():
+                    self._write(self._out_write,
+                                channel.recv(self.chunk_size))
+                elif channel.recv_stderr_ready():
+                    self._write(self._err_write,
+                                channel.recv_stderr(self.chunk_size))
+                elif channel.eof_received or channel.closed:
+                    break
+                else:
+                    ready.wait(1.0)
+        except (OSError, IOError, EOFError, paramiko.SSHException):
+            pass
+        finally:
+            os.close(self._out_write)
+            os.close(self._err_write)
+
+    @staticmethod
+    def _write(fd, data):
+        while data:
+            try:
+                written = os.write(fd, data)
+            except OSError as err:
+                if err.errno == errno.EINTR:
+                    continue
+                raise
+            data = data[written:]
+
+    def poll(self):
+        """Return the returncode if the command is done. None if not."""
+        if self._pump_thread.is_alive():
+            return None
+
+        return self.wait()
+
+    def wait(self):
+        """Wait for the command to complete.
+
+        Returns:
+            The returncode of the command.
+        """
+        self._pump_thread.join()
+        if self.returncode is None:
+            status = self._channel.recv_exit_status()
+            if self._killed and status == -1:
+                status = -9
+            self.returncode = status
+            self._channel.close()
+
+        return self.returncode
+
+    def communicate(self, input=None):
+        """Send input, read all output, and wait for the command to complete.
+
+        Args:
+            input (optional[str]): Data to send to the command's stdin.
+
+        Returns:
+            A tuple of (stdout, stderr).
+        """
+        if input:
+            self.stdin.write(input)
+        self.stdin.close()
+
+        stdout_fd = self.stdout.fileno()
+        stderr_fd = self.stderr.fileno()
+        output = {stdout_fd: [], stderr_fd: []}
+        open_fds = [stdout_fd, stderr_fd]
+        while open_fds:
+            try:
+                ready, _, _ = select.select(open_fds, [], [])
+            except select.error as err:
+                if err.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd in ready:
+                data = os.read(fd, self.chunk_size)
+                if data:
+                    output[fd].append(data)
+                else:
+                    open_fds.remove(fd)
+
+        self.stdout.close()
+        self.stderr.close()
+        self.wait()
+
+        return (''.join(output[stdout_fd]), ''.join(output[stderr_fd]))
+
+    def kill(self):
+        """Kill the command by closing the channel."""
+        self._killed = True
+        self._channel.close()
+
+    terminate = kill
+
+
+class _ChannelStdin(object):
+    """A minimal writable file for a channel's stdin."""
+
+    def __init__(self, channel):
+        self._channel = channel
+        self.closed = False
+
+    def write(self, data):
+        self._channel.sendall(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self._channel.shutdown_write()
+            except (EOFError, socket.error, paramiko.SSHException):
+                pass
@@ -25,16 +25,382 @@ WARNING:
     against a system running the same version of Python.
     (see rpyc module install docs for more information)
 """
+import gzip
+import hashlib
 import inspect
+import io
+import os
+import pickle
+import pipes
+import sys
+import tarfile
+import threading
+import time
 import types
+from contextlib import contextmanager
 
+import rpyc
+import rpyc.utils.classic
+import rpyc.version
+import rpyc.utils.factory
 from rpyc.utils.zerodeploy import DeployedServer
 
 
+SERVER_SCRIPT = r"""
+import os
+import sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+
+from rpyc.core.service import SlaveService
+from rpyc.utils.server import ThreadedServer
+
+server = ThreadedServer(SlaveService, hostname="localhost", port=0,
+                        reuse_addr=True)
+
+if len(sys.argv) > 1:
+    # attach mode. run in the background and record the pid and port.
+    portfile = sys.argv[1]
+    with open("%s.%i" % (portfile, os.getpid()), "w") as fd:
+        fd.write("%i %i\n" % (os.getpid(), server.port))
+    os.rename("%s.%i" % (portfile, os.getpid()), portfile)
+    server.start()
+else:
+    # run until the ssh session (stdin) is closed
+    thread = server._start_in_thread()
+    sys.stdout.write("%i\n" % server.port)
+    sys.stdout.flush()
+    try:
+        sys.stdin.read()
+    finally:
+        server.close()
+        thread.join(2)
+"""
+"""The rpyc server started from a staged bundle"""
+
+ATTACH_SHELL_FUNCTIONS = r"""
+portfile=server-$(id -un).port
+lock() {
+    # serialize starting and stopping the attached servers of the user
+    exec 9>>"$1"
+    if command -v flock >/dev/null; then
+        flock -w 60 9
+    fi
+}
+stop() {
+    for file in "$@"; do
+        [ -f "$file" ] || continue
+        pid=$(cut -d" " -f1 "$file")
+        if ps -p "$pid" -o args= 2>/dev/null | grep -q glusto_rpyc_server
+        then
+            kill "$pid"
+        fi
+        rm -f "$file"
+    done
+}
+"""
+"""Shell functions to start and stop attached rpyc servers"""
+
+BATCH_SOURCE = r"""
+def _glusto_batch_call(functions, payload):
+    import importlib
+    import pickle
+    try:
+        import __builtin__ as builtins
+    except ImportError:
+        import builtins
+
+    def resolve(name):
+        parts = name.split('.')
+        for i in range(len(parts) - 1, 0, -1):
+            try:
+                obj = importlib.import_module('.'.join(parts[:i]))
+            except ImportError:
+                continue
+            for attr in parts[i:]:
+                obj = getattr(obj, attr)
+            return obj
+        return getattr(builtins, name)
+
+    resolved = {}
+    results = []
+    for function, args, kwargs in pickle.loads(payload):
+        try:
+            if isinstance(function, int):
+                func = functions[function]
+            else:
+                if function not in resolved:
+                    resolved[function] = resolve(function)
+                func = resolved[function]
+            results.append(func(*args, **kwargs))
+        except Exception as err:
+            results.append(err)
+
+    return pickle.dumps(results, 2)
+"""
+"""The remote side of rpyc_batch_call()"""
+
+MEMBERS_SOURCE = r"""
+def _glusto_get_members(names):
+    namespace = globals()
+    return tuple((name, namespace[name]) for name in names
+                 if name in namespace)
+"""
+"""Fetches the members of a module defined by rpyc_define_module()"""
+
+
+class _StagedServer(object):
+    """An rpyc server started from a bundle staged on the remote system.
+
+    Provides the classic_connect() and close() methods of rpyc's
+    DeployedServer, so the two can be used interchangeably.
+    """
+
+    def __init__(self, remote_machine, bundle_dir, attach=False):
+        self.remote_machine = remote_machine
+        self.proc = None
+        self.tun = None
+        python = ('PY=$(command -v python%i.%i || command -v python%i || '
+                  'command -v python)' % (sys.version_info[0],
+                                          sys.version_info[1],
+                                          sys.version_info[0]))
+
+        if attach:
+            # reuse the server left running by an earlier session,
+            # or start one in the background for later sessions.
+            # servers started from other (older) bundles are stopped.
+            script = ('cd %s || exit 1\n%s\n'
+                      'lock ../server-$(id -un).lock\n'
+                      'if [ -f $portfile ] && '
+                      'kill -0 $(cut -d" " -f1 $portfile) 2>/dev/null; then '
+                      'cut -d" " -f2 $portfile; exit 0; fi\n'
+                      'stop ../*/$portfile\n%s\n'
+                      'setsid $PY glusto_rpyc_server.py $portfile '
+                      '</dev/null >/dev/null 2>&1 9>&- &\n'
+                      'for i in $(seq 100); do [ -f $portfile ] && break; '
+                      'sleep 0.1; done\n'
+                      'cut -d" " -f2 $portfile' %
+                      (pipes.quote(bundle_dir), ATTACH_SHELL_FUNCTIONS,
+                       python))
+            retcode, stdout, stderr = self._sh(script).run(retcode=None)
+            line = stdout
+        else:
+            script = ('cd %s || exit 1\n%s\nexec $PY glusto_rpyc_server.py' %
+                      (pipes.quote(bundle_dir), python))
+            self.proc = self._sh(script).popen(new_session=True)
+            line = self.proc.stdout.readline()
+
+        try:
+            self.remote_port = int(line.strip())
+        except ValueError:
+            self.close()
+            raise RuntimeError("Starting the rpyc server in %s failed: %r" %
+                               (bundle_dir, line))
+
+        self.local_port = rpyc.utils.factory._get_free_port()
+        self.tun = remote_machine.tunnel(self.local_port, self.remote_port)
+
+    def __del__(self):
+        self.close()
+
+    def _sh(self, script):
+        """Build a remote sh command for a script."""
+        return self.remote_machine["sh"]["-c", script]
+
+    def classic_connect(self):
+        """Connect to the server through the ssh tunnel."""
+        return rpyc.utils.classic.connect("localhost", self.local_port)
+
+    def close(self):
+        """Close the tunnel and stop the server (unless attached)."""
+        if self.proc is not None:
+            try:
+                self.proc.terminate()
+            except Exception:
+                pass
+            self.proc = None
+        if self.tun is not None:
+            try:
+                self.tun.close()
+            except Exception:
+                pass
+            self.tun = None
+
+
+class _RpycPool(object):
+    """A pool of rpyc connections to the server on one user@host.
+
+    Connections are checked out by one thread at a time. The pool grows
+    on demand up to max_size connections, then callers wait for one to be
+    checked in. Dead connections are replaced.
+    """
+
+    ping_after = 10
+    """Seconds a connection can sit idle before it is pinged on checkout"""
+
+    def __init__(self, create, max_size, on_close=None):
+        self.max_size = max_size
+        self._create = create
+        self._on_close = on_close
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.stats = {'created': 0, 'reused': 0, 'replaced': 0, 'waits': 0}
+        """Counters for connections created, reused from the pool,
+        replaced after failing a health check, and checkouts that waited
+        for a connection to be checked in."""
+
+    def __len__(self):
+        return self._size
+
+    def checkout(self, timeout=None):
+        """Get a connection for the exclusive use of the caller.
+
+        Args:
+            timeout (optional[float]): Seconds to wait for a connection
+                when all max_size connections are checked out.
+                Waits forever by default.
+
+        Returns:
+            An rpyc connection. Return it with checkin().
+            None if no connection was checked in before the timeout.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        while True:
+            with self._cond:
+                waited = False
+                while not self._idle and self._size >= self.max_size:
+                    if not waited:
+                        self.stats['waits'] += 1
+                        waited = True
+                    wait = None
+                    if deadline is not None:
+                        wait = deadline - time.time()
+                        if wait <= 0:
+                            return None
+                    self._cond.wait(wait)
+
+                if self._idle:
+                    connection, idle_since = self._idle.pop()
+                else:
+                    connection = None
+                    self._size += 1
+
+            if connection is None:
+                try:
+                    connection = self._create()
+                except Exception:
+                    self._release_slot()
+                    raise
+                self._count('created')
+                return connection
+
+            if self._healthy(connection, idle_since):
+                self._count('reused')
+                return connection
+
+            self._count('replaced')
+            self.discard(connection)
+
+    def _count(self, stat):
+        with self._cond:
+            self.stats[stat] += 1
+
+    def _healthy(self, connection, idle_since):
+        """Check a connection from the pool still works."""
+        if connection.closed:
+            return False
+        if time.time() - idle_since < self.ping_after:
+            return True
+        try:
+            connection.ping(timeout=3)
+        except Exception:
+            return False
+
+        return True
+
+    def checkin(self, connection):
+        """Return a connection to the pool.
+
+        Args:
+            connection (obj): A connection from checkout().
+        """
+        with self._cond:
+            if not connection.closed and not self._closed:
+                self._idle.append((connection, time.time()))
+                self._cond.notify()
+                return
+
+        self.discard(connection)
+
+    def discard(self, connection):
+        """Close a checked out connection and free its place in the pool.
+
+        Args:
+            connection (obj): A connection from checkout().
+        """
+        self._close_connection(connection)
+        self._release_slot()
+
+    def _close_connection(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        if self._on_close:
+            self._on_close(connection)
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def close(self):
+        """Close the idle connections.
+
+        Connections checked out at the time are closed on checkin.
+        """
+        with self._cond:
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+            self._closed = True
+
+        for connection, _ in idle:
+            self._close_connection(connection)
+
+
 class Rpycable(object):
 
     _rpyc_connections = {}
     _deployed_servers = {}
+    _rpyc_lock = threading.Lock()
+    _rpyc_name_locks = {}
+    """Locks serializing the setup of each deployed server and connection"""
+    rpyc_deploy_mode = 'zerodeploy'
+    """How the rpyc server is started on a remote system.
+    'zerodeploy' copies rpyc to a new temporary directory every time.
+    'staged' starts the server from a bundle staged once per system.
+    'attach' also reuses a server left running by an earlier session.
+    Override with rpyc_deploy_mode in the config."""
+    rpyc_deploy_dir = '.glusto/rpyc'
+    """The remote directory for staged bundles (relative to the home
+    directory of the user). Override with rpyc_deploy_dir in the config."""
+    _rpyc_bundle = None
+    _rpyc_staged = {}
+    rpyc_pool_size = 8
+    """The default maximum number of pooled rpyc connections per user@host
+    (see rpyc_pool()). Override with rpyc_pool_size in the config."""
+    _rpyc_pools = {}
+    _rpyc_helpers = {}
+    """Remote helper functions defined on each rpyc connection.
+    Dropped when the connection is closed (netrefs in the helpers keep
+    their connection alive)."""
 
     @classmethod
     def _rpyc_get_connection_name(cls, host, user=None, instance=None):
@@ -59,6 +425,19 @@ class Rpycable(object):
 
         return connection_name
 
+    @classmethod
+    def _rpyc_name_lock(cls, name):
+        """Get the lock for setting up a deployed server or connection.
+
+        Args:
+            name (str): The name of the deployed server or connection.
+
+        Returns:
+            A threading.Lock object.
+        """
+        with cls._rpyc_lock:
+            return cls._rpyc_name_locks.setdefault(name, threading.Lock())
+
     @classmethod
     def _rpyc_get_deployed_server(cls, name, ssh_connection=None):
         """Create and cache a deployed server object.
@@ -71,19 +450,134 @@ class Rpycable(object):
             A new or cached deployed_server object.
         """
         cls.log.debug("getting deployed server")
-        if name not in cls._deployed_servers:
-            deployed_server = DeployedServer(ssh_connection)
-            cls._deployed_servers[name] = deployed_server
-            cls.log.debug("cached deployed server %s" % name)
-        else:
-            cls.log.debug("getting deployed server %s from cache" % name)
-            deployed_server = cls._deployed_servers[name]
+        # other threads wait for the one deploying to the host
+        with cls._rpyc_name_lock(name):
+            if name not in cls._deployed_servers:
+                mode = cls.config.get('rpyc_deploy_mode',
+                                      cls.rpyc_deploy_mode)
+                if mode not in ('zerodeploy', 'staged', 'attach'):
+                    cls.log.error("Unknown rpyc_deploy_mode: %s" % mode)
+                    return None
+
+                with cls.metrics_timer('connect_seconds', 'rpyc_deploy',
+                                       name.split('@')[-1]):
+                    if mode == 'zerodeploy':
+                        deployed_server = DeployedServer(ssh_connection)
+                    else:
+                        bundle_dir = cls._rpyc_stage_bundle(name,
+                                                            ssh_connection)
+                        deployed_server = \
+                            _StagedServer(ssh_connection, bundle_dir,
+                                          attach=(mode == 'attach'))
+                cls._deployed_servers[name] = deployed_server
+                cls.log.debug("cached deployed server %s" % name)
+            else:
+                cls.log.debug("getting deployed server %s from cache" % name)
+                deployed_server = cls._deployed_servers[name]
 
         if deployed_server:
             return deployed_server
 
         return None
 
+    @classmethod
+    def _rpyc_get_bundle(cls):
+        """Build the bundle of rpyc and the server script (once).
+
+        The bundle is a gzipped tarball built without timestamps or owners,
+        so the same rpyc version always builds the same bytes.
+
+        Returns:
+            A tuple of the bundle (str) and its sha256 hexdigest.
+        """
+        with cls._rpyc_lock:
+            if cls._rpyc_bundle:
+                return cls._rpyc_bundle
+
+            def add(tar, arcname, data):
+                info = tarfile.TarInfo(arcname)
+                info.size = len(data)
+                info.mode = 0o644
+                tar.addfile(info, io.BytesIO(data))
+
+            rpyc_root = os.path.dirname(os.path.abspath(rpyc.__file__))
+            bundle = io.BytesIO()
+            gzfile = gzip.GzipFile(fileobj=bundle, mode='wb', mtime=0)
+            tar = tarfile.open(fileobj=gzfile, mode='w')
+            for dirpath, dirnames, filenames in os.walk(rpyc_root):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if not filename.endswith('.py'):
+                        continue
+                    path = os.path.join(dirpath, filename)
+                    arcname = os.path.join(
+                        'rpyc', os.path.relpath(path, rpyc_root))
+                    with open(path, 'rb') as fd:
+                        add(tar, arcname, fd.read())
+            add(tar, 'glusto_rpyc_server.py', SERVER_SCRIPT.encode('utf-8'))
+            tar.close()
+            gzfile.close()
+
+            data = bundle.getvalue()
+            cls._rpyc_bundle = (data, hashlib.sha256(data).hexdigest())
+
+            return cls._rpyc_bundle
+
+    @classmethod
+    def _rpyc_stage_bundle(cls, name, ssh_connection):
+        """Stage the rpyc bundle on a remote system if it is not there.
+
+        Bundles are staged in a directory named for the rpyc version and
+        the bundle hash, so a new bundle is only sent when rpyc changes.
+        The bundle is checked against its hash on the remote system and
+        moved into place in one step, so a partial upload is never used.
+
+        Args:
+            name (str): The name of the deployed server (user@host).
+            ssh_connection (obj): A plumbum SshMachine connection.
+
+        Returns:
+            The path of the bundle directory on the remote system.
+        """
+        data, digest = cls._rpyc_get_bundle()
+        deploy_dir = cls.config.get('rpyc_deploy_dir', cls.rpyc_deploy_dir)
+        bundle_dir = "%s/rpyc-%s-%s" % (deploy_dir.rstrip('/'),
+                                        rpyc.version.version_string,
+                                        digest[:16])
+        if cls._rpyc_staged.get(name) == bundle_dir:
+            return bundle_dir
+
+        sh = ssh_connection["sh"]
+        quoted_dir = pipes.quote(bundle_dir)
+        retcode, _, _ = sh["-c", "test -d %s" % quoted_dir].run(retcode=None)
+        if retcode != 0:
+            cls.log.info("Staging rpyc bundle %s on %s" % (bundle_dir, name))
+            script = ('set -e\n'
+                      'tmp=%s.tmp.$$\n'
+                      'mkdir -p "$tmp"\n'
+                      'cat > "$tmp/bundle.tgz"\n'
+                      'echo "%s  $tmp/bundle.tgz" | sha256sum -c --status\n'
+                      'tar xzf "$tmp/bundle.tgz" -C "$tmp"\n'
+                      'rm -f "$tmp/bundle.tgz"\n'
+                      '# another session might have staged it first\n'
+                      'mv -T "$tmp" %s 2>/dev/null || rm -rf "$tmp"\n'
+                      'test -d %s' %
+                      (quoted_dir, digest, quoted_dir, quoted_dir))
+            proc = sh["-c", script].popen()
+            stdout, stderr = proc.communicate(data)
+            if proc.returncode != 0:
+                raise RuntimeError("Staging rpyc bundle on %s failed: %s" %
+                                   (name, stderr))
+            cls.metrics_observe('transfer_bytes', 'rpyc_stage',
+                                name.split('@')[-1], len(data))
+        else:
+            cls.log.debug("rpyc bundle %s already staged on %s" %
+                          (bundle_dir, name))
+
+        cls._rpyc_staged[name] = bundle_dir
+
+        return bundle_dir
+
     @classmethod
     def _rpyc_get_classic_connection(cls, name, deployed_server):
         """Create and cache an rpyc classic connection object.
@@ -96,12 +590,15 @@ class Rpycable(object):
             A new or cached classic connection object.
         """
         cls.log.debug("getting classic connection")
-        if name not in cls._rpyc_connections:
-            classic_connection = deployed_server.classic_connect()
-            cls._rpyc_connections[name] = classic_connection
-            cls.log.debug('Cached connection for %s' % name)
-        else:
-            classic_connection = cls._rpyc_connections[name]
+        with cls._rpyc_name_lock(name):
+            if name not in cls._rpyc_connections:
+                with cls.metrics_timer('connect_seconds', 'rpyc',
+                                       name.split('@')[-1].split(':')[0]):
+                    classic_connection = deployed_server.classic_connect()
+                cls._rpyc_connections[name] = classic_connection
+                cls.log.debug('Cached connection for %s' % name)
+            else:
+                classic_connection = cls._rpyc_connections[name]
 
         if classic_connection:
             return classic_connection
@@ -129,7 +626,9 @@ class Rpycable(object):
         # if no existing connection, create one
         if conn_name not in cls._rpyc_connections:
             cls.log.debug("Creating rpyc connection: %s" % conn_name)
-            ssh_connection = cls._get_ssh_connection(host, user)
+            # rpyc zerodeploy requires a plumbum SshMachine
+            ssh_connection = cls._get_ssh_connection(host, user,
+                                                     backend='plumbum')
 
             if ssh_connection:
                 cls.log.debug("deployed server setup")
@@ -161,22 +660,351 @@ class Rpycable(object):
         return None
 
     @classmethod
-    def rpyc_create_connections(cls, hosts, user=None, num_instances=1):
+    def rpyc_create_connections(cls, hosts, user=None, num_instances=1,
+                                max_workers=None):
         """Setup and cache multiple connections via rpyc.
 
+        rpyc is deployed to the hosts in parallel. Once the server is up
+        on a host, the rest of its instances connect in parallel.
+
         Args:
-            host (str): The hostname or IP of the remote system.
+            hosts (list): A list of hostnames or IPs of the remote systems.
             user (str): A user on the remote system. Default: root
             num_instances (int): The number of the instances to create.
+            max_workers (optional[int]): The maximum number of hosts
+                to deploy to at the same time.
+                Defaults to max_workers in the config (or 32).
 
         Returns:
-            Nothing.
+            A dictionary of rpyc connection objects (None for connections
+            that failed). Labeled by the connection name (user@host:instance).
+
+        Example:
+            >>> from glusto.core import Glusto as g
+            >>> connections = g.rpyc_create_connections(g.config['nodes'],
+            ...                                         num_instances=4)
+            >>> failed = [name for name, connection in connections.items()
+            ...           if connection is None]
+        """
+        def connect_instance(host, instance=1):
+            try:
+                return cls.rpyc_get_connection(host, user=user,
+                                               instance=instance)
+            except Exception as err:
+                cls.log.error("rpyc connection to %s failed: %s" %
+                              (cls._rpyc_get_connection_name(host, user,
+                                                             instance), err))
+                return None
+
+        def connect_host(host):
+            connections = {1: connect_instance(host)}
+            instances = range(2, num_instances + 1)
+            if not connections[1] or not instances:
+                connections.update((instance, None) for instance in instances)
+                return connections
+
+            def connect_other(instance):
+                return connect_instance(host, instance)
+
+            for instance, connection in cls._parallel_map(
+                    connect_other, instances, max_workers=len(instances),
+                    operation='rpyc_create_connections',
+                    host_of=lambda instance: host):
+                connections[instance] = connection
+
+            return connections
+
+        results = {}
+        for host, connections in cls._parallel_map(
+                connect_host, hosts, max_workers=max_workers,
+                operation='rpyc_create_connections'):
+            for instance, connection in connections.items():
+                name = cls._rpyc_get_connection_name(host, user, instance)
+                results[name] = connection
+
+        failed = [name for name, connection in results.items()
+                  if connection is None]
+        if failed:
+            cls.log.error("Failed rpyc connections: %s" %
+                          ", ".join(sorted(failed)))
+
+        return results
+
+    @classmethod
+    @contextmanager
+    def rpyc_pool(cls, host, user=None, timeout=None):
+        """Check out a pooled rpyc connection for use in a with statement.
+
+        Each user@host has a pool of connections to its deployed server.
+        A connection is used by one caller at a time, so threads can share
+        rpyc without juggling instance numbers. The pool grows up to
+        rpyc_pool_size connections (from the config, or 8). Connections
+        that closed or do not answer a ping are replaced.
+
+        Args:
+            host (str): The hostname or IP of the remote system.
+            user (str): A user on the remote system. Default: root
+            timeout (optional[float]): Seconds to wait for a free connection
+                when all of them are checked out. Waits forever by default.
+
+        Returns:
+            A context manager returning an rpyc connection object.
+            The connection is checked back in at the end of the with block.
+
+        Raises:
+            RuntimeError: if no connection is free before the timeout,
+                or a new connection can not be made.
+
+        Example:
+            >>> from glusto.core import Glusto as g
+            >>> with g.rpyc_pool("bunkerhill") as conn:
+            ...     conn.modules.os.path.exists("/var/log/glusterfs")
+            True
+        """
+        pool = cls._rpyc_get_pool(host, user)
+        start = time.time()
+        connection = pool.checkout(timeout)
+        cls.metrics_observe('queue_wait_seconds', 'rpyc_pool', host,
+                            time.time() - start)
+        if connection is None:
+            raise RuntimeError("No pooled rpyc connection to %s was free "
+                               "after %ss" % (host, timeout))
+
+        try:
+            yield connection
+        finally:
+            pool.checkin(connection)
+
+    @classmethod
+    def _rpyc_get_pool(cls, host, user=None):
+        """Get (or create) the rpyc connection pool for a user@host.
+
+        Args:
+            host (str): The hostname or IP of the remote system.
+            user (str): A user on the remote system. Default: root
+
+        Returns:
+            An _RpycPool object.
+        """
+        name = cls._rpyc_get_connection_name(host, user)
+
+        def create():
+            # rpyc zerodeploy requires a plumbum SshMachine
+            ssh_connection = cls._get_ssh_connection(host, user,
+                                                     backend='plumbum')
+            if not ssh_connection:
+                raise RuntimeError("SSH Connection Failed: %s" % name)
+            deployed_server = cls._rpyc_get_deployed_server(name,
+                                                            ssh_connection)
+            if not deployed_server:
+                raise RuntimeError("Deploying rpyc failed: %s" % name)
+            cls.log.debug("Creating pooled rpyc connection: %s" % name)
+            with cls.metrics_timer('connect_seconds', 'rpyc', host):
+                return deployed_server.classic_connect()
+
+        with cls._rpyc_lock:
+            pool = cls._rpyc_pools.get(name)
+            if pool is None:
+                max_size = int(cls.config.get('rpyc_pool_size',
+                                              cls.rpyc_pool_size))
+                pool = cls._rpyc_pools[name] = _RpycPool(
+                    create, max_size, on_close=cls._rpyc_forget_helpers)
+
+        return pool
+
+    @classmethod
+    def rpyc_pool_stats(cls):
+        """Get the counters for the rpyc connection pools.
+
+        Args:
+            None
+
+        Returns:
+            A dictionary of 'created', 'reused', 'replaced', and 'waits'
+            counts, and the number of open connections ('size').
+            Labeled by user@host.
+        """
+        stats = {}
+        with cls._rpyc_lock:
+            for name, pool in cls._rpyc_pools.items():
+                stats[name] = dict(pool.stats)
+                stats[name]['size'] = len(pool)
+
+        return stats
+
+    @classmethod
+    def _rpyc_close_pools(cls, name=None):
+        """Close the rpyc connection pools.
+
+        Args:
+            name (optional[str]): Only close the pool for this user@host.
+
+        Returns:
+            Nothing
+        """
+        with cls._rpyc_lock:
+            names = [key for key in cls._rpyc_pools
+                     if name is None or key == name]
+            pools = [cls._rpyc_pools.pop(key) for key in names]
+
+        for pool in pools:
+            pool.close()
+
+    @classmethod
+    def rpyc_batch_call(cls, connection, calls, return_exceptions=False):
+        """Run a list of calls on the remote system in a single round-trip.
+
+        The calls and their arguments are pickled and sent in one request.
+        The results are pickled on the remote system and returned by value
+        (not as netrefs), so using them costs no more round-trips.
+
+        Args:
+            connection (obj): An rpyc connection object.
+            calls (list): A list of (function, args) or
+                (function, args, kwargs) tuples.
+                function is the dotted name of a function on the remote
+                system (e.g., 'os.path.exists') or a local function, which
+                is teleported to the remote system. A teleported function
+                can only use builtins and the modules it imports itself.
+                args and kwargs must be picklable.
+            return_exceptions (optional[bool]): Return the exception raised
+                by a call in place of its result. By default, the first
+                exception is raised after the batch has run.
+
+        Returns:
+            A list of the results (which must be picklable) in the order
+            of the calls.
+
+        Example:
+            >>> from glusto.core import Glusto as g
+            >>> conn = g.rpyc_get_connection("bunkerhill")
+            >>> g.rpyc_batch_call(conn, [('os.path.exists', ('/etc/hosts',)),
+            ...                          ('os.getloadavg', ()),
+            ...                          ('socket.gethostname', ())])
+            [True, (0.08, 0.03, 0.05), 'bunkerhill']
+        """
+        start = time.time()
+        functions = []
+        teleported = {}
+        payload = []
+        for call in calls:
+            function = call[0]
+            args = tuple(call[1]) if len(call) > 1 else ()
+            kwargs = dict(call[2]) if len(call) > 2 else {}
+            if not isinstance(function, basestring):
+                if function not in teleported:
+                    teleported[function] = len(functions)
+                    functions.append(cls._rpyc_teleport(connection, function))
+                function = teleported[function]
+            payload.append((function, args, kwargs))
+
+        batch_call = cls._rpyc_get_helper(connection, '_glusto_batch_call',
+                                          BATCH_SOURCE)
+        results = pickle.loads(batch_call(tuple(functions),
+                                          pickle.dumps(payload, 2)))
+
+        cls.metrics_observe('command_seconds', 'rpyc_batch_call',
+                            cls._rpyc_connection_host(connection),
+                            time.time() - start)
+
+        if not return_exceptions:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+
+        return results
+
+    @classmethod
+    def rpyc_map(cls, connection, function, items, return_exceptions=False):
+        """Call a function with each item of a list on the remote system.
+
+        All of the calls run in a single round-trip (see rpyc_batch_call()).
+
+        Args:
+            connection (obj): An rpyc connection object.
+            function (str|callable): The dotted name of a function on the
+                remote system or a local function to teleport.
+            items (list): The (picklable) items to call the function with.
+            return_exceptions (optional[bool]): Return the exception raised
+                by a call in place of its result.
+
+        Returns:
+            A list of the results in the order of the items.
+
+        Example:
+            >>> paths = ['/mnt/testvol/file%i' % i for i in range(1000)]
+            >>> exists = g.rpyc_map(conn, 'os.path.exists', paths)
+
+            With a local function...
+
+            >>> def file_size(path):
+            ...     import os
+            ...     return os.stat(path).st_size
+            >>> sizes = g.rpyc_map(conn, file_size, paths)
+        """
+        return cls.rpyc_batch_call(connection,
+                                   [(function, (item,)) for item in items],
+                                   return_exceptions=return_exceptions)
+
+    @classmethod
+    def _rpyc_get_helper(cls, connection, name, source):
+        """Get a helper function defined on the remote system.
+
+        The source is executed once per connection.
+
+        Args:
+            connection (obj): An rpyc connection object.
+            name (str): The name of the function defined by source.
+            source (str): The source code of the function.
+
+        Returns:
+            A netref to the remote function.
+        """
+        with cls._rpyc_lock:
+            helpers = cls._rpyc_helpers.setdefault(connection, {})
+            helper = helpers.get(name)
+        if helper is None:
+            connection.execute(source)
+            helper = connection.namespace[name]
+            with cls._rpyc_lock:
+                helpers[name] = helper
+
+        return helper
+
+    @classmethod
+    def _rpyc_forget_helpers(cls, connection):
+        """Drop the helpers cached for a closed connection.
+
+        Args:
+            connection (obj): An rpyc connection object.
+
+        Returns:
+            Nothing
         """
-        for i in range(1, num_instances + 1):
-            for host in hosts:
-                cls.rpyc_get_connection(host, user=user, instance=i)
+        with cls._rpyc_lock:
+            cls._rpyc_helpers.pop(connection, None)
 
-        # TODO: what to return here. a dictionary of connections created ???
+    @classmethod
+    def _rpyc_teleport(cls, connection, function):
+        """Teleport a local function to the remote system (once).
+
+        Args:
+            connection (obj): An rpyc connection object.
+            function (callable): A local function.
+
+        Returns:
+            A netref to the remote copy of the function.
+        """
+        with cls._rpyc_lock:
+            helpers = cls._rpyc_helpers.setdefault(connection, {})
+            remote_function = helpers.get(function)
+        if remote_function is None:
+            remote_function = rpyc.utils.classic.teleport_function(
+                connection, function, def_=False)
+            with cls._rpyc_lock:
+                helpers[function] = remote_function
+
+        return remote_function
 
     @classmethod
     def rpyc_get_connections(cls):
@@ -270,6 +1098,7 @@ class Rpycable(object):
         cls.log.debug("closing rpyc connection %s" % name)
         del cls._rpyc_connections[name]
         connection.close()
+        cls._rpyc_forget_helpers(connection)
 
     @classmethod
     def rpyc_close_connections(cls):
@@ -286,6 +1115,7 @@ class Rpycable(object):
             connection = cls._rpyc_connections[key]
             del cls._rpyc_connections[key]
             connection.close()
+            cls._rpyc_forget_helpers(connection)
 
     @classmethod
     def rpyc_close_deployed_servers(cls):
@@ -298,6 +1128,7 @@ class Rpycable(object):
             Nothing
         """
         cls.rpyc_close_connections()
+        cls._rpyc_close_pools()
 
         for key in cls._deployed_servers.keys():
             cls.log.debug("closing rpyc deployed server %s" % key)
@@ -324,6 +1155,8 @@ class Rpycable(object):
                 connection = cls._rpyc_connections[rpyckey]
                 del cls._rpyc_connections[rpyckey]
                 connection.close()
+                cls._rpyc_forget_helpers(connection)
+        cls._rpyc_close_pools(name)
 
         deployed_server = cls._rpyc_get_deployed_server(name)
         cls.log.debug("closing rpyc connection %s" % name)
@@ -331,30 +1164,123 @@ class Rpycable(object):
         deployed_server.close()
 
     @classmethod
-    def rpyc_define_module(cls, connection, local_module):
+    def rpyc_stop_attached_server(cls, host, user=None):
+        """Stop the rpyc servers left running on a system in attach mode.
+
+        Closes the deployed server and connections for the user@host first.
+        Servers started from every staged bundle of the user are stopped.
+
+        Args:
+            host (str): The hostname or IP of the remote system.
+            user (str): A user on the remote system. Default: root
+
+        Returns:
+            True on success. False on failure.
+
+        Example:
+            >>> from glusto.core import Glusto as g
+            >>> g.rpyc_stop_attached_server('192.168.1.221')
+            True
+        """
+        name = cls._rpyc_get_connection_name(host, user)
+        if name in cls._deployed_servers:
+            cls.rpyc_close_deployed_server(host, user)
+
+        deploy_dir = cls.config.get('rpyc_deploy_dir', cls.rpyc_deploy_dir)
+        script = ('cd %s 2>/dev/null || exit 0\n%s\n'
+                  'lock server-$(id -un).lock\n'
+                  'stop */$portfile' %
+                  (pipes.quote(deploy_dir.rstrip('/')),
+                   ATTACH_SHELL_FUNCTIONS))
+        retcode, _, stderr = cls.run(host, script, user=user)
+        if retcode != 0:
+            cls.log.error("Stopping the attached rpyc server on %s failed: "
+                          "%s" % (name, stderr))
+            return False
+
+        return True
+
+    @classmethod
+    def rpyc_define_module(cls, connection, local_module, force=False):
         """Define a local module on the remote system
 
+        The module is cached for each connection. It is only defined again
+        when its source code changes, so repeat calls cost no round-trips.
+        All modules share the namespace of the connection, so defining
+        a module drops the cached modules that bind any of the same
+        top-level names (other than modules) to different objects.
+
         Args:
             connection (obj): An rpyc connection object.
             local_module (obj): The module object being defined on the remote.
+            force (optional[bool]): Define the module again even if the
+                source code has not changed (e.g., to reset its globals).
 
         Returns:
             A module object representing the local module defined on remote
         """
+        start = time.time()
         sourcecode = inspect.getsource(local_module)
+        digest = hashlib.sha256(sourcecode.encode('utf-8')
+                                if isinstance(sourcecode, unicode)
+                                else sourcecode).hexdigest()
+        key = ('module', local_module.__name__)
+        with cls._rpyc_lock:
+            helpers = cls._rpyc_helpers.setdefault(connection, {})
+            cached = helpers.get(key)
+        if cached and cached[0] == digest and not force:
+            return cached[1]
+
         members = inspect.getmembers(local_module)
+        names = tuple(name for name, _ in members)
+        # the names that running the module (re)binds in the namespace
+        defines = dict((name, value) for name, value in members
+                       if not isinstance(value, types.ModuleType) and
+                       not (name.startswith('__') and name.endswith('__')))
         remote_module = types.ModuleType('remote_module', 'remote module')
 
+        with cls._rpyc_lock:
+            # a module whose names are bound to other objects now
+            # has to be defined again
+            for helper_key, helper in helpers.items():
+                if not isinstance(helper_key, tuple) or \
+                        helper_key[0] != 'module':
+                    continue
+                if any(name in defines and defines[name] is not value
+                       for name, value in helper[2].items()):
+                    del helpers[helper_key]
         connection.execute(sourcecode)
-        for name, _ in members:
-            try:
-                robject = connection.namespace[name]
-                setattr(remote_module, name, robject)
-            except:
-                pass
+        # one round-trip for all of the members
+        get_members = cls._rpyc_get_helper(connection, '_glusto_get_members',
+                                           MEMBERS_SOURCE)
+        for name, robject in get_members(names):
+            setattr(remote_module, name, robject)
+
+        with cls._rpyc_lock:
+            helpers[key] = (digest, remote_module, defines)
+
+        cls.metrics_observe('command_seconds', 'rpyc_define_module',
+                            cls._rpyc_connection_host(connection),
+                            time.time() - start)
 
         return remote_module
 
+    @classmethod
+    def _rpyc_connection_host(cls, connection):
+        """Find the host of a cached rpyc connection (for metrics).
+
+        Args:
+            connection (obj): An rpyc connection object.
+
+        Returns:
+            The hostname. An empty string if the connection is not cached.
+        """
+        for name, cached_connection in cls._rpyc_connections.items():
+            if cached_connection is connection:
+                return name.split('@')[-1].split(':')[0]
+
+        return ''
+
 
 # TODO: log instead of print
 # TODO: more robust error checking
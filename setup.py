@@ -21,5 +21,8 @@ setup(name='glusto',
             ]
                     },
       install_requires=['plumbum', 'rpyc', 'PyYAML', 'jinja2',
-                        'pytest', 'nose', 'unittest-xml-reporting']
+                        'pytest', 'nose', 'unittest-xml-reporting'],
+      extras_require={
+        'native': ['paramiko'],
+        }
       )
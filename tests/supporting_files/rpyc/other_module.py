@@ -0,0 +1,5 @@
+myvariable = "something else"
+
+
+def get_myvariable():
+    return myvariable
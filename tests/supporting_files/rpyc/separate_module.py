@@ -0,0 +1,5 @@
+import os
+
+
+def get_cwd():
+    return os.getcwd()
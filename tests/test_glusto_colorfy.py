@@ -54,6 +54,20 @@ class TestGlustoColorfy(unittest.TestCase):
         self.assertEqual(message, self.non_color_message,
                          "non color message does not match expectation")
 
+    def test_colorfy_codes(self):
+        g.config['log_color'] = True
+
+        start, end = g.colorfy_codes(g.RED | g.BG_YELLOW | g.BOLD)
+
+        self.assertEqual("%s%s%s" % (start, self.non_color_message, end),
+                         self.color_message,
+                         "color codes do not match expectation")
+
+        g.config['log_color'] = False
+
+        self.assertEqual(g.colorfy_codes(g.RED), ('', ''),
+                         "color codes returned with log_color False")
+
     def tearDown(self):
         """Unittest tearDown override"""
         print "Tearing Down: %s" % self.id()
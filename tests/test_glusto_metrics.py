@@ -0,0 +1,118 @@
+# Copyright 2016 Jonathan Holloway <loadtheaccumulator@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Test glusto metrics functionality"""
+import json
+import unittest
+
+from glusto.core import Glusto as g
+
+
+class TestGlustoMetrics(unittest.TestCase):
+    """Glusto metrics test class"""
+    @classmethod
+    def setUpClass(cls):
+        """unittest standard setUpClass method
+        Runs before all test_ methods in the class
+        """
+        print "Setting Up Class: %s" % cls.__name__
+
+        cls.json_file = '/tmp/glusto_test_metrics.json'
+        cls.prometheus_file = '/tmp/glusto_test_metrics.prom'
+
+    def setUp(self):
+        """unittest standard setUp method
+        Runs before each test_ method
+        """
+        print "Setting Up: %s" % self.id()
+        g.metrics_reset()
+
+    def test_metrics_observe(self):
+        """Testing metrics_observe() and metrics_get() methods"""
+        g.metrics_observe('command_seconds', 'run', 'bunkerhill', 0.2)
+        g.metrics_observe('command_seconds', 'run', 'bunkerhill', 0.4)
+        g.metrics_observe('transfer_bytes', 'upload', 'bunkerhill', 2048)
+
+        metrics = g.metrics_get()
+        histogram = metrics['command_seconds']['run']['bunkerhill']
+        self.assertEqual(histogram['count'], 2)
+        self.assertAlmostEqual(histogram['mean'], 0.3)
+        self.assertEqual(histogram['min'], 0.2)
+        self.assertEqual(histogram['max'], 0.4)
+        self.assertIn([0.25, 1], histogram['buckets'])
+        self.assertIn([0.5, 2], histogram['buckets'])
+
+        histogram = metrics['transfer_bytes']['upload']['bunkerhill']
+        self.assertIn([16384, 1], histogram['buckets'])
+
+        g.metrics_reset()
+        self.assertEqual(g.metrics_get(), {})
+
+    def test_metrics_run_local(self):
+        """Testing metrics recorded by run_local()"""
+        g.run_local('true')
+        with g.metrics_timer('command_seconds', 'custom', 'localhost'):
+            pass
+
+        metrics = g.metrics_get()
+        self.assertEqual(
+            metrics['command_seconds']['run_local']['localhost']['count'], 1)
+        self.assertEqual(
+            metrics['command_seconds']['custom']['localhost']['count'], 1)
+
+    def test_metrics_queue_wait(self):
+        """Testing queue_wait_seconds recorded by parallel operations"""
+        pairs = [('bunkerhill', 'breedshill'), ('bunkerhill', 'dorchester')]
+        results = dict(g._parallel_map(lambda pair: True, pairs,
+                                       operation='upload_many_relay',
+                                       host_of=lambda pair: pair[1]))
+        self.assertEqual(len(results), 2)
+        list(g._parallel_map(lambda host: True, ['bunkerhill']))
+
+        metrics = g.metrics_get()
+        self.assertEqual(sorted(metrics['queue_wait_seconds'].keys()),
+                         ['upload_many_relay'])
+        self.assertEqual(
+            sorted(metrics['queue_wait_seconds']['upload_many_relay']),
+            ['breedshill', 'dorchester'])
+
+    def test_metrics_dump(self):
+        """Testing metrics_dump_json() and metrics_dump_prometheus()"""
+        g.metrics_observe('command_seconds', 'run', 'bunkerhill', 0.2)
+
+        g.metrics_dump_json(self.json_file)
+        with open(self.json_file) as fd:
+            metrics = json.load(fd)
+        self.assertEqual(
+            metrics['command_seconds']['run']['bunkerhill']['count'], 1)
+
+        g.metrics_dump_prometheus(self.prometheus_file)
+        with open(self.prometheus_file) as fd:
+            lines = fd.read().splitlines()
+        self.assertIn('# TYPE glusto_command_seconds histogram', lines)
+        self.assertIn('glusto_command_seconds_bucket{operation="run",'
+                      'host="bunkerhill",le="+Inf"} 1', lines)
+        self.assertIn('glusto_command_seconds_count{operation="run",'
+                      'host="bunkerhill"} 1', lines)
+
+    def tearDown(self):
+        """Unittest tearDown override"""
+        print "Tearing Down: %s" % self.id()
+
+    @classmethod
+    def tearDownClass(cls):
+        """unittest tearDownClass override"""
+        print "Tearing Down Class: %s" % cls.__name__
+        g.metrics_reset()
@@ -49,6 +49,78 @@ class TestGlustoRpyc(unittest.TestCase):
 
         self.assertTrue(pingable, "Connection did not ping.")
 
+    def test_create_connections(self):
+        """Testing rpyc connections to many hosts"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+
+        nodes = g.config["nodes"]
+        connections = g.rpyc_create_connections(nodes, num_instances=2)
+
+        self.assertEqual(len(connections), len(nodes) * 2)
+        for node in nodes:
+            for instance in (1, 2):
+                name = "%s@%s:%i" % (g.user, node, instance)
+                self.assertIsNotNone(connections[name])
+                self.assertIs(connections[name],
+                              g.rpyc_get_connection(node, instance=instance))
+
+    def test_pool(self):
+        """Testing pooled rpyc connections"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+
+        with g.rpyc_pool(self.masternode) as conn1:
+            with g.rpyc_pool(self.masternode) as conn2:
+                self.assertIsNot(conn1, conn2)
+                self.assertEqual(conn2.modules.sys.platform, 'linux2')
+
+        with g.rpyc_pool(self.masternode) as conn3:
+            self.assertIn(conn3, (conn1, conn2))
+
+        # closed connections are replaced
+        conn3.close()
+        with g.rpyc_pool(self.masternode) as conn4:
+            self.assertTrue(conn4.ping() is None)
+
+        name = "%s@%s" % (g.user, self.masternode)
+        self.assertEqual(g.rpyc_pool_stats()[name]['created'], 2)
+
+    def test_staged_deploy(self):
+        """Testing rpyc connection from a staged bundle"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+
+        g.rpyc_close_deployed_servers()
+        g.config['rpyc_deploy_mode'] = 'staged'
+        try:
+            connection = g.rpyc_get_connection(self.masternode)
+            self.assertEqual(connection.modules.sys.platform, 'linux2')
+            self.assertIn('/.glusto/rpyc/rpyc-',
+                          connection.modules.os.getcwd())
+        finally:
+            del g.config['rpyc_deploy_mode']
+            g.rpyc_close_deployed_servers()
+
+    def test_attach_deploy(self):
+        """Testing rpyc connection to an attached server"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+
+        g.rpyc_close_deployed_servers()
+        g.config['rpyc_deploy_mode'] = 'attach'
+        try:
+            connection = g.rpyc_get_connection(self.masternode)
+            server_pid = connection.modules.os.getpid()
+            g.rpyc_close_deployed_servers()
+
+            # the server is still running. attach to it.
+            connection = g.rpyc_get_connection(self.masternode)
+            self.assertEqual(connection.modules.os.getpid(), server_pid)
+
+            self.assertTrue(g.rpyc_stop_attached_server(self.masternode))
+            rcode, _, _ = g.run(self.masternode, 'kill -0 %i' % server_pid)
+            self.assertNotEqual(rcode, 0)
+        finally:
+            del g.config['rpyc_deploy_mode']
+            g.rpyc_close_deployed_servers()
+
     def test_local_module_on_remote(self):
         """Testing local module definition on remote system"""
         connection = g.rpyc_get_connection(self.masternode)
@@ -75,6 +147,41 @@ class TestGlustoRpyc(unittest.TestCase):
         output = x.instance_method()
         self.assertIn('instance:', output)
 
+    def test_local_module_cached(self):
+        """Testing local module definition is cached per connection"""
+        connection = g.rpyc_get_connection(self.masternode)
+        import supporting_files.rpyc.local_module
+        r1 = g.rpyc_define_module(connection,
+                                  supporting_files.rpyc.local_module)
+        r2 = g.rpyc_define_module(connection,
+                                  supporting_files.rpyc.local_module)
+        self.assertIs(r1, r2)
+
+        r3 = g.rpyc_define_module(connection,
+                                  supporting_files.rpyc.local_module,
+                                  force=True)
+        self.assertIsNot(r1, r3)
+        self.assertEqual(r3.myvariable, 'yada yada yada')
+
+        # the modules share a namespace. defining another module that
+        # redefines myvariable means local_module is defined again.
+        import supporting_files.rpyc.other_module
+        g.rpyc_define_module(connection,
+                             supporting_files.rpyc.other_module)
+        r4 = g.rpyc_define_module(connection,
+                                  supporting_files.rpyc.local_module)
+        self.assertIsNot(r3, r4)
+        self.assertEqual(r4.myvariable, 'yada yada yada')
+
+        # a module that only shares the os module with local_module
+        # leaves it cached.
+        import supporting_files.rpyc.separate_module
+        g.rpyc_define_module(connection,
+                             supporting_files.rpyc.separate_module)
+        r5 = g.rpyc_define_module(connection,
+                                  supporting_files.rpyc.local_module)
+        self.assertIs(r4, r5)
+
     def test_remote_call(self):
 
         rpyc_conn = g.rpyc_get_connection(self.masternode)
@@ -82,6 +189,28 @@ class TestGlustoRpyc(unittest.TestCase):
 
         self.assertEqual(platform, 'linux2')
 
+    def test_batch_call(self):
+        """Testing batched rpyc calls"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        rpyc_conn = g.rpyc_get_connection(self.masternode)
+
+        results = g.rpyc_batch_call(rpyc_conn,
+                                    [('os.path.exists', ('/etc/hosts',)),
+                                     ('os.path.join', ('/tmp', 'file')),
+                                     ('len', ([1, 2, 3],))])
+        self.assertEqual(results, [True, '/tmp/file', 3])
+
+        def double(value):
+            return value * 2
+
+        self.assertEqual(g.rpyc_map(rpyc_conn, double, [1, 2, 3]), [2, 4, 6])
+
+        results = g.rpyc_map(rpyc_conn, 'os.stat', ['/nonexistent'],
+                             return_exceptions=True)
+        self.assertIsInstance(results[0], OSError)
+        self.assertRaises(OSError, g.rpyc_map, rpyc_conn, 'os.stat',
+                          ['/nonexistent'])
+
     def tearDown(self):
         """Unittest tearDown override"""
         print "Tearing Down: %s" % self.id()
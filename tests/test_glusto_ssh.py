@@ -14,6 +14,7 @@
 # along with this software. If not, see <http://www.gnu.org/licenses/>.
 #
 """Test glusto SSH functionality"""
+import os
 import unittest
 import pytest
 
@@ -95,6 +96,276 @@ class TestGlustoSsh(unittest.TestCase):
             print rout
             self.assertEqual(rerr, '')
 
+    def test_run_parallel_max_workers(self):
+        """Testing SSH run_parallel() method with a worker cap and timeout"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        results = g.run_parallel(self.hosts, 'echo -n %s' % self.test_string,
+                                 max_workers=2, timeout=60)
+        self.assertEqual(sorted(results.keys()), sorted(self.hosts))
+        for host, result in results.iteritems():
+            rcode, rout, rerr = result
+            self.assertEqual(rcode, 0)
+            self.assertEqual(rout, self.test_string)
+            self.assertEqual(rerr, '')
+
+    def test_run_timeout(self):
+        """Testing SSH run() method with a timeout"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        rcode, rout, _ = g.run(self.primary_host,
+                               'echo %s; sleep 600' % self.test_string,
+                               timeout=2)
+        self.assertEqual(rcode, g.TIMEOUT_RETCODE)
+        self.assertEqual(rout, '%s\n' % self.test_string)
+
+        # the remote command is killed too
+        rcode, _, _ = g.run(self.primary_host, 'pgrep -f "sleep 600"')
+        self.assertEqual(rcode, 1)
+
+        results = g.run_parallel(self.hosts, 'sleep 600', timeout=2)
+        for host, result in results.iteritems():
+            self.assertEqual(result[0], g.TIMEOUT_RETCODE)
+
+    def test_run_capture(self):
+        """Testing SSH run() method with output capture limits"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        rcode, rout, _ = g.run(self.primary_host, 'seq 1 100000',
+                               capture=1000)
+        self.assertEqual(rcode, 0)
+        self.assertTrue(rout.startswith('1\n2\n'))
+        self.assertTrue(rout.endswith('99999\n100000\n'))
+        self.assertIn('bytes truncated', rout)
+
+        rcode, rout, _ = g.run(self.primary_host, 'seq 1 100000',
+                               capture='file')
+        self.assertEqual(rcode, 0)
+        rcode, expected, _ = g.run_local('seq 1 100000')
+        self.assertEqual(rout.read(), expected)
+
+    def test_run_cache(self):
+        """Testing SSH run() method with a result cache"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        command = 'date +%s%N'
+        g.run_cache_invalidate()
+        result = g.run(self.primary_host, command, cache_ttl=60)
+        hits = g.run_cache_stats()['hits']
+        self.assertEqual(g.run(self.primary_host, command, cache_ttl=60),
+                         result)
+        self.assertEqual(g.run_cache_stats()['hits'], hits + 1)
+
+        self.assertEqual(g.run_cache_invalidate(host=self.primary_host), 1)
+        self.assertNotEqual(g.run(self.primary_host, command, cache_ttl=60),
+                            result)
+
+    def test_run_stream(self):
+        """Testing SSH run_stream() method"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        command = 'echo %s; echo %s >&2' % (self.test_string,
+                                            self.test_string)
+        retcodes = {}
+        for host, stream, line in g.run_stream(self.hosts, command):
+            self.assertIn(host, self.hosts)
+            if stream == 'retcode':
+                retcodes[host] = line
+            else:
+                self.assertIn(stream, ['stdout', 'stderr'])
+                self.assertEqual(line, '%s\n' % self.test_string)
+        self.assertEqual(sorted(retcodes.keys()), sorted(self.hosts))
+        self.assertEqual(set(retcodes.values()), set([0]))
+
+    def test_arun_many(self):
+        """Testing SSH arun_many() method"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        results = g.arun_many(self.hosts, 'echo -n %s' % self.test_string,
+                              concurrency=2)
+        self.assertEqual(sorted(results.keys()), sorted(self.hosts))
+        for host, result in results.iteritems():
+            rcode, rout, rerr = result
+            self.assertEqual(rcode, 0)
+            self.assertEqual(rout, self.test_string)
+            self.assertEqual(rerr, '')
+
+    def test_run_until(self):
+        """Testing SSH run_until() method"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        satisfied, results = g.run_until(self.hosts, 'true', condition='any')
+        self.assertTrue(satisfied)
+        self.assertEqual(len(results), 1)
+
+        satisfied, results = g.run_until(self.hosts, 'false', condition='all')
+        self.assertFalse(satisfied)
+        self.assertEqual(len(results), 1)
+
+        satisfied, results = g.run_until(self.hosts, 'true',
+                                         condition='quorum')
+        self.assertTrue(satisfied)
+        self.assertEqual(len(results), len(self.hosts) // 2 + 1)
+
+    def test_run_rolling(self):
+        """Testing SSH run_rolling() method"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        progress = []
+        completed, results, failed = g.run_rolling(
+            self.hosts, 'true', batch_size='50%', health_check='true',
+            progress_callback=progress.append)
+        self.assertTrue(completed)
+        self.assertEqual(sorted(results), sorted(self.hosts))
+        self.assertEqual(failed, [])
+        self.assertEqual(progress[-1]['done'], len(self.hosts))
+
+        completed, results, failed = g.run_rolling(self.hosts, 'false')
+        self.assertFalse(completed)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(len(failed), 1)
+
+    def test_wait_for(self):
+        """Testing SSH wait_for() method"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        ready, report = g.wait_for(self.hosts, 'true', timeout=30)
+        self.assertTrue(ready)
+        for host in self.hosts:
+            self.assertTrue(report[host]['ready'])
+            self.assertEqual(report[host]['attempts'], 1)
+
+        ready, report = g.wait_for(self.primary_host, 'false', interval=0.5,
+                                   timeout=2)
+        self.assertFalse(ready)
+        self.assertFalse(report[self.primary_host]['ready'])
+        self.assertIsNone(report[self.primary_host]['seconds'])
+        self.assertGreater(report[self.primary_host]['attempts'], 1)
+
+    def test_arun_gather(self):
+        """Testing SSH arun() and arun_gather() methods"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        proc1 = g.arun(self.primary_host, 'echo -n %s' % self.test_string)
+        proc2 = g.arun(self.primary_host, 'echo -n %s >&2; exit 3' %
+                       self.test_string)
+        results = g.arun_gather([proc1, proc2])
+        self.assertEqual(results[0], (0, self.test_string, ''))
+        self.assertEqual(results[1], (3, '', self.test_string))
+
+    def test_connection_pool(self):
+        """Testing SSH connection pool reuse and stats"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        g.run(self.primary_host, 'true')
+        connections = g.ssh_get_connections()
+        hits = connections.stats['hits']
+        self.assertIn('root@%s' % self.primary_host, connections)
+        g.run(self.primary_host, 'true')
+        self.assertEqual(connections.stats['hits'], hits + 1)
+
+        # read-only dictionary access
+        name = 'root@%s' % self.primary_host
+        self.assertIs(connections.get(name), connections[name])
+        self.assertIsNone(connections.get('nobody@nowhere'))
+        self.assertIn(connections[name], connections.values())
+        self.assertEqual(dict(connections.iteritems()), connections.copy())
+
+    def test_ssh_channels(self):
+        """Testing concurrent commands on multiple channels to one host"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        g.config['ssh_channels_per_host'] = 2
+        try:
+            proc1 = g.run_async(self.primary_host, 'sleep 1; echo -n 1')
+            proc2 = g.run_async(self.primary_host, 'sleep 1; echo -n 2')
+            self.assertEqual(proc1.async_communicate(), (0, '1', ''))
+            self.assertEqual(proc2.async_communicate(), (0, '2', ''))
+            self.assertIn('root@%s#1' % self.primary_host,
+                          g.ssh_get_connections())
+        finally:
+            g.config.pop('ssh_channels_per_host')
+
+    def test_ssh_connect_all(self):
+        """Testing SSH ssh_connect_all() method"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        results = g.ssh_connect_all(self.hosts)
+        self.assertEqual(sorted(results.keys()), sorted(self.hosts))
+        self.assertNotIn(False, results.values())
+
+    def test_run_native_backend(self):
+        """Testing SSH run() method with the native backend"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        g.config['ssh_backend'] = 'native'
+        try:
+            rcode, rout, rerr = g.run(self.primary_host,
+                                      'echo -n %s' % self.test_string)
+        finally:
+            g.config.pop('ssh_backend')
+        self.assertEqual(rcode, 0)
+        self.assertEqual(rout, self.test_string)
+        self.assertEqual(rerr, '')
+        self.assertIn('root@%s (native)' % self.primary_host,
+                      g.ssh_get_connections())
+
+    def test_run_async_native_backend(self):
+        """Testing SSH run_async() method with the native backend"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        g.config['ssh_backend'] = 'native'
+        try:
+            # stderr only, with output after the command exits
+            command = ('for i in 1 2 3; do echo -n $i >&2; sleep 0.1; done; '
+                       '(sleep 1; echo -n %s) & exit 3' % self.test_string)
+            proc = g.run_async(self.primary_host, command)
+            rcode, rout, rerr = proc.async_communicate()
+        finally:
+            g.config.pop('ssh_backend')
+        self.assertEqual(rcode, 3)
+        self.assertEqual(rout, self.test_string)
+        self.assertEqual(rerr, '123')
+
+    def test_upload_download_native_backend(self):
+        """Testing SSH upload() and download() methods with the native
+        backend"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        g.run(self.primary_host, 'rm -f /tmp/upload_test_file')
+        g.run_local('rm -f /tmp/download_test_file')
+        g.config['ssh_backend'] = 'native'
+        try:
+            g.upload(self.primary_host, '/etc/hosts',
+                     '/tmp/upload_test_file')
+            g.download(self.primary_host, '/tmp/upload_test_file',
+                       '/tmp/download_test_file')
+        finally:
+            g.config.pop('ssh_backend')
+        _, md5sum, _ = g.run_local('md5sum < /etc/hosts')
+        _, md5sum_up, _ = g.run(self.primary_host,
+                                'md5sum < /tmp/upload_test_file')
+        _, md5sum_down, _ = g.run_local('md5sum < /tmp/download_test_file')
+        self.assertEqual(md5sum_up, md5sum)
+        self.assertEqual(md5sum_down, md5sum)
+
+    def test_run_batch(self):
+        """Testing SSH run_batch() method"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        commands = ['echo -n %s' % self.test_string,
+                    'echo -n %s >&2; exit 2' % self.test_string,
+                    'echo -n %s' % self.test_string]
+        results = g.run_batch(self.primary_host, commands)
+        self.assertEqual(results, [(0, self.test_string, ''),
+                                   (2, '', self.test_string),
+                                   (0, self.test_string, '')])
+
+        results = g.run_batch(self.primary_host, commands,
+                              stop_on_failure=True)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[1][0], 2)
+
+    def test_session(self):
+        """Testing SSH session() method"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        with g.session(self.primary_host) as session:
+            session.run('cd /tmp; export GLUSTO_TEST=%s' % self.test_string)
+            rcode, rout, rerr = session.run('pwd; echo -n $GLUSTO_TEST >&2')
+            self.assertEqual(rcode, 0)
+            self.assertEqual(rout, '/tmp\n')
+            self.assertEqual(rerr, self.test_string)
+
+            rcode, _, _ = session.run('exit 3')
+            self.assertEqual(rcode, 3)
+            rcode, rout, _ = session.run('echo -n $GLUSTO_TEST')
+            self.assertEqual(rcode, 0)
+            self.assertEqual(rout, '')
+            self.assertEqual(session.restarts, 1)
+
     def test_upload(self):
         """Testing SSH upload() method"""
         print "Running: %s - %s" % (self.id(), self.shortDescription())
@@ -110,6 +381,21 @@ class TestGlustoSsh(unittest.TestCase):
             md5sum_up = rout.strip()
         self.assertEqual(md5sum, md5sum_up, '')
 
+    def test_upload_many(self):
+        """Testing SSH upload_many() method"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        rcode, rout, _ = g.run_local('md5sum /etc/hosts | awk \'{print $1}\'')
+        md5sum = rout.strip()
+        for relay in (False, True):
+            g.run_parallel(self.transfer_hosts, 'rm -f /tmp/upload_test_file')
+            results = g.upload_many(self.transfer_hosts, '/etc/hosts',
+                                    '/tmp/upload_test_file', relay=relay)
+            self.assertNotIn(False, results.values())
+            command = 'md5sum /tmp/upload_test_file | awk \'{print $1}\''
+            for host, result in g.run_parallel(self.transfer_hosts,
+                                               command).iteritems():
+                self.assertEqual(result[1].strip(), md5sum)
+
     def test_download(self):
         """Testing SSH download() method"""
         print "Running: %s - %s" % (self.id(), self.shortDescription())
@@ -139,6 +425,71 @@ class TestGlustoSsh(unittest.TestCase):
         # compare the md5sums
         self.assertEqual(md5sum_down, md5sum_up, 'md5sums do not match')
 
+    def test_upload_sync(self):
+        """Testing SSH upload_sync() and download_sync() methods"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        g.run(self.primary_host, 'rm -rf /tmp/sync_test_dir')
+        g.run_local('rm -rf /tmp/sync_test_download')
+        report = g.upload_sync(self.primary_host, 'tests/supporting_files',
+                               '/tmp/sync_test_dir')
+        self.assertEqual(report['retcode'], 0)
+        self.assertNotEqual(report['transferred'], [])
+
+        # nothing changed. nothing to send.
+        report = g.upload_sync(self.primary_host, 'tests/supporting_files',
+                               '/tmp/sync_test_dir')
+        self.assertEqual(report['transferred'], [])
+        self.assertNotEqual(report['bytes_saved'], 0)
+
+        report = g.download_sync(self.primary_host, '/tmp/sync_test_dir',
+                                 '/tmp/sync_test_download', compare='mtime')
+        self.assertEqual(report['retcode'], 0)
+        rcode, _, _ = g.run_local('diff -r tests/supporting_files '
+                                  '/tmp/sync_test_download')
+        self.assertEqual(rcode, 0)
+
+        # a single file into an existing directory keeps its name
+        for compare in ('checksum', 'mtime'):
+            report = g.upload_sync(self.primary_host, '/etc/hosts',
+                                   '/tmp/sync_test_dir', compare=compare)
+            self.assertEqual(report['retcode'], 0)
+            report = g.download_sync(self.primary_host,
+                                     '/tmp/sync_test_dir/hosts',
+                                     '/tmp/sync_test_download',
+                                     compare=compare)
+            self.assertEqual(report['retcode'], 0)
+            report = g.download_sync(self.primary_host,
+                                     '/tmp/sync_test_dir/hosts',
+                                     '/tmp/sync_test_download',
+                                     compare=compare)
+            self.assertEqual(report['transferred'], [])
+        rcode, _, _ = g.run_local('cmp /etc/hosts '
+                                  '/tmp/sync_test_download/hosts')
+        self.assertEqual(rcode, 0)
+
+    def test_download_stream(self):
+        """Testing SSH download_stream() and download_stream_many() methods"""
+        print "Running: %s - %s" % (self.id(), self.shortDescription())
+        g.run_local('rm -rf /tmp/stream_test_download')
+        g.run(self.primary_host, 'rm -rf /tmp/stream_test_dir')
+        g.upload(self.primary_host, 'tests/supporting_files',
+                 '/tmp/stream_test_dir')
+
+        report = g.download_stream(self.primary_host, '/tmp/stream_test_dir',
+                                   '/tmp/stream_test_download')
+        self.assertEqual(report['retcode'], 0)
+        self.assertNotEqual(report['bytes'], 0)
+        rcode, _, _ = g.run_local('diff -r tests/supporting_files %s' %
+                                  report['path'])
+        self.assertEqual(rcode, 0)
+
+        reports = g.download_stream_many([self.primary_host],
+                                         '/tmp/stream_test_dir',
+                                         '/tmp/stream_test_download',
+                                         extract=False)
+        self.assertEqual(reports[self.primary_host]['retcode'], 0)
+        self.assertTrue(os.path.exists(reports[self.primary_host]['path']))
+
     def test_transfer(self):
         """Testing SSH transfer() method"""
         print "Running: %s - %s" % (self.id(), self.shortDescription())
@@ -218,4 +569,8 @@ class TestGlustoSsh(unittest.TestCase):
         print "Tearing Down Class: %s" % cls.__name__
         g.run(cls.primary_host, 'rm -f /tmp/railetc')
         g.run(cls.primary_host, 'rm -f /tmp/upload_test_file')
+        g.run(cls.primary_host, 'rm -rf /tmp/sync_test_dir')
+        g.run(cls.primary_host, 'rm -rf /tmp/stream_test_dir')
+        g.run_local('rm -rf /tmp/stream_test_download')
+        g.run_local('rm -rf /tmp/sync_test_download')
         g.run(cls.hosts[1], 'rm -f /tmp/transfer_test_file')